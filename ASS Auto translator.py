@@ -11,10 +11,1229 @@ import re
 import os
 from pathlib import Path
 import openai
-from typing import List, Dict
+from typing import List, Dict, Iterator
 import configparser
+import codecs
 import threading
 import time
+import random
+import hashlib
+import sqlite3
+import json
+import math
+import unicodedata
+import sys
+from array import array
+from collections import Counter, deque
+from itertools import accumulate
+from concurrent.futures import (ThreadPoolExecutor, as_completed, wait,
+                                FIRST_COMPLETED,
+                                TimeoutError as FutureTimeoutError)
+
+try:
+    import tiktoken
+except ImportError:
+    # Optionnel : sans tiktoken, les tokens sont estimés par caractère
+    tiktoken = None
+
+
+# Erreurs de transport, déjà reprises (et attendues) par call_api
+TRANSPORT_ERRORS = (openai.RateLimitError, openai.InternalServerError,
+                    openai.APIConnectionError)
+
+# Ids de réponse : "N" (une langue cible) ou "N.L" (plusieurs langues)
+NUMBERED_LINE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\.\s*(.*)$')
+JSON_ITEM_PATTERN = re.compile(
+    r'\{\s*"id"\s*:\s*"?(\d+(?:\.\d+)?)"?\s*,'
+    r'\s*"text"\s*:\s*("(?:[^"\\]|\\.)*")\s*\}')
+
+# Balises ASS qu'une traduction doit reproduire à l'identique
+# (les marqueurs {n} de TagMask en font partie)
+ASS_TAG_PATTERN = re.compile(r'\{[^}]*\}|\\[Nnh]')
+# Blocs de balises de surcharge retirés du texte envoyé à la traduction
+OVERRIDE_BLOCK_PATTERN = re.compile(r'\{[^}]*\}')
+# Découpage d'un champ Text en morceaux de texte et balises alternés
+TAG_SPLIT_PATTERN = re.compile(f'({ASS_TAG_PATTERN.pattern})')
+# Marqueur remplaçant une suite de balises dans le texte envoyé ({1}, {2}...)
+PLACEHOLDER_PATTERN = re.compile(r'( ?)\{(\d+)\}( ?)')
+# Numérotation de lot restée en tête de ligne ("3. ", "3.1. ", "[3] ")
+LEFTOVER_NUMBER_PATTERN = re.compile(r'^\s*(?:\d+(?:\.\d+)?[.)]|\[\d+\])\s')
+
+# Dessin vectoriel ({\p1}...{\p0}) et syllabes de karaoké ({\k20}, {\kf15}...)
+DRAWING_TAG_PATTERN = re.compile(r'\\p[1-9]')
+KARAOKE_TAG_PATTERN = re.compile(r'\\(?:k|K|kf|ko)\d')
+
+# Actions du tri des événements
+TRIAGE_ACTIONS = ('translate', 'copy', 'skip')
+
+# Écritures attendues par langue cible (début des noms Unicode des lettres)
+LANGUAGE_SCRIPTS = {
+    "Russe": ("CYRILLIC",),
+    "Japonais": ("HIRAGANA", "KATAKANA", "CJK"),
+    "Chinois": ("CJK",),
+    "Coréen": ("HANGUL", "CJK"),
+    "Arabe": ("ARABIC",),
+    "Hindi": ("DEVANAGARI",),
+}
+for _language in ("Français", "Anglais", "Espagnol", "Italien", "Allemand",
+                  "Portugais", "Néerlandais", "Suédois", "Norvégien",
+                  "Danois", "Finnois", "Polonais", "Tchèque", "Hongrois"):
+    LANGUAGE_SCRIPTS[_language] = ("LATIN",)
+
+# Langues reconnues à leur seule écriture (début des noms Unicode des lettres)
+SCRIPT_LANGUAGES = {
+    "CYRILLIC": "Russe",
+    "HANGUL": "Coréen",
+    "ARABIC": "Arabe",
+    "DEVANAGARI": "Hindi",
+}
+
+# Textes d'apprentissage du modèle de trigrammes des langues latines
+# (répliques courantes, mêmes phrases d'une langue à l'autre)
+LANGUAGE_SAMPLES = {
+    "Français": (
+        "je ne sais pas ce que tu veux dire mais il faut partir maintenant "
+        "est-ce que tu as vu ça c'est vraiment incroyable on va y aller ensemble "
+        "qu'est-ce qui se passe ici pourquoi tu ne m'as rien dit je suis désolé "
+        "nous devons trouver une solution avant qu'il ne soit trop tard "
+        "elle n'est pas encore rentrée à la maison il était une fois dans un petit village "
+        "merci beaucoup pour ton aide tu es vraiment quelqu'un de bien "
+        "attends-moi je reviens tout de suite c'est toujours la même chose avec vous "
+        "les enfants jouent dans le jardin et leurs parents les regardent"),
+    "Anglais": (
+        "i don't know what you mean but we have to leave right now "
+        "did you see that it's really amazing we're going there together "
+        "what is going on here why didn't you tell me anything i'm sorry "
+        "we need to find a way before it is too late "
+        "she hasn't come back home yet once upon a time in a small village "
+        "thank you so much for your help you are really a good person "
+        "wait for me i'll be right back it's always the same thing with you "
+        "the children are playing in the garden and their parents are watching them"),
+    "Espagnol": (
+        "no sé lo que quieres decir pero tenemos que irnos ahora mismo "
+        "has visto eso es realmente increíble vamos a ir juntos "
+        "qué está pasando aquí por qué no me dijiste nada lo siento mucho "
+        "tenemos que encontrar una solución antes de que sea demasiado tarde "
+        "ella todavía no ha vuelto a casa había una vez en un pequeño pueblo "
+        "muchas gracias por tu ayuda eres una buena persona de verdad "
+        "espérame ahora vuelvo siempre es lo mismo con vosotros "
+        "los niños juegan en el jardín y sus padres los miran"),
+    "Italien": (
+        "non so cosa vuoi dire ma dobbiamo andarcene subito "
+        "hai visto quello è davvero incredibile ci andiamo insieme "
+        "che cosa sta succedendo qui perché non mi hai detto niente mi dispiace "
+        "dobbiamo trovare una soluzione prima che sia troppo tardi "
+        "lei non è ancora tornata a casa c'era una volta in un piccolo villaggio "
+        "grazie mille per il tuo aiuto sei davvero una brava persona "
+        "aspettami torno subito è sempre la stessa cosa con voi "
+        "i bambini giocano nel giardino e i loro genitori li guardano"),
+    "Allemand": (
+        "ich weiß nicht was du meinst aber wir müssen jetzt sofort gehen "
+        "hast du das gesehen das ist wirklich unglaublich wir gehen zusammen hin "
+        "was ist hier los warum hast du mir nichts gesagt es tut mir leid "
+        "wir müssen eine lösung finden bevor es zu spät ist "
+        "sie ist noch nicht nach hause gekommen es war einmal in einem kleinen dorf "
+        "vielen dank für deine hilfe du bist wirklich ein guter mensch "
+        "warte auf mich ich bin gleich wieder da es ist immer dasselbe mit euch "
+        "die kinder spielen im garten und ihre eltern schauen ihnen zu"),
+    "Portugais": (
+        "não sei o que você quer dizer mas temos que ir embora agora "
+        "você viu isso é realmente incrível vamos juntos "
+        "o que está acontecendo aqui por que você não me disse nada desculpe "
+        "precisamos encontrar uma solução antes que seja tarde demais "
+        "ela ainda não voltou para casa era uma vez em uma pequena aldeia "
+        "muito obrigado pela sua ajuda você é mesmo uma boa pessoa "
+        "espere por mim eu já volto é sempre a mesma coisa com vocês "
+        "as crianças brincam no jardim e os pais delas estão olhando"),
+    "Néerlandais": (
+        "ik weet niet wat je bedoelt maar we moeten nu meteen weg "
+        "heb je dat gezien het is echt ongelooflijk we gaan er samen heen "
+        "wat is hier aan de hand waarom heb je me niets verteld het spijt me "
+        "we moeten een oplossing vinden voordat het te laat is "
+        "ze is nog niet thuisgekomen er was eens in een klein dorp "
+        "heel erg bedankt voor je hulp je bent echt een goed mens "
+        "wacht op mij ik ben zo terug het is altijd hetzelfde met jullie "
+        "de kinderen spelen in de tuin en hun ouders kijken naar hen"),
+    "Suédois": (
+        "jag vet inte vad du menar men vi måste gå nu direkt "
+        "såg du det det är verkligen otroligt vi går dit tillsammans "
+        "vad är det som händer här varför sa du ingenting till mig förlåt "
+        "vi måste hitta en lösning innan det är för sent "
+        "hon har inte kommit hem än det var en gång i en liten by "
+        "tack så mycket för din hjälp du är verkligen en bra människa "
+        "vänta på mig jag kommer strax tillbaka det är alltid samma sak med er "
+        "barnen leker i trädgården och deras föräldrar tittar på dem"),
+    "Norvégien": (
+        "jeg vet ikke hva du mener men vi må dra nå med en gang "
+        "så du det det er virkelig utrolig vi drar dit sammen "
+        "hva er det som skjer her hvorfor sa du ingenting til meg unnskyld "
+        "vi må finne en løsning før det er for sent "
+        "hun har ikke kommet hjem ennå det var en gang i en liten landsby "
+        "tusen takk for hjelpen du er virkelig et godt menneske "
+        "vent på meg jeg kommer straks tilbake det er alltid det samme med dere "
+        "barna leker i hagen og foreldrene deres ser på dem"),
+    "Danois": (
+        "jeg ved ikke hvad du mener men vi skal gå nu med det samme "
+        "så du det det er virkelig utroligt vi tager derhen sammen "
+        "hvad sker der her hvorfor sagde du ikke noget til mig undskyld "
+        "vi er nødt til at finde en løsning før det er for sent "
+        "hun er ikke kommet hjem endnu der var engang i en lille landsby "
+        "mange tak for din hjælp du er virkelig et godt menneske "
+        "vent på mig jeg er straks tilbage det er altid det samme med jer "
+        "børnene leger i haven og deres forældre kigger på dem"),
+    "Finnois": (
+        "en tiedä mitä tarkoitat mutta meidän täytyy lähteä heti nyt "
+        "näitkö tuon se on todella uskomatonta mennään sinne yhdessä "
+        "mitä täällä tapahtuu miksi et kertonut minulle mitään olen pahoillani "
+        "meidän on löydettävä ratkaisu ennen kuin on liian myöhäistä "
+        "hän ei ole vielä tullut kotiin olipa kerran pienessä kylässä "
+        "kiitos paljon avustasi olet todella hyvä ihminen "
+        "odota minua tulen heti takaisin se on aina sama juttu teidän kanssanne "
+        "lapset leikkivät puutarhassa ja heidän vanhempansa katsovat heitä"),
+    "Polonais": (
+        "nie wiem co masz na myśli ale musimy natychmiast iść "
+        "widziałeś to to jest naprawdę niesamowite pójdziemy tam razem "
+        "co tu się dzieje dlaczego nic mi nie powiedziałeś przepraszam "
+        "musimy znaleźć rozwiązanie zanim będzie za późno "
+        "ona jeszcze nie wróciła do domu dawno temu w małej wiosce "
+        "bardzo dziękuję za twoją pomoc jesteś naprawdę dobrym człowiekiem "
+        "poczekaj na mnie zaraz wracam z wami zawsze jest to samo "
+        "dzieci bawią się w ogrodzie a ich rodzice na nie patrzą"),
+    "Tchèque": (
+        "nevím co tím myslíš ale musíme hned teď odejít "
+        "viděl jsi to je to opravdu neuvěřitelné půjdeme tam spolu "
+        "co se tady děje proč jsi mi nic neřekl promiň "
+        "musíme najít řešení než bude příliš pozdě "
+        "ještě se nevrátila domů bylo nebylo v jedné malé vesnici "
+        "moc děkuji za tvou pomoc jsi opravdu dobrý člověk "
+        "počkej na mě hned jsem zpátky s vámi je to pořád stejné "
+        "děti si hrají na zahradě a jejich rodiče se na ně dívají"),
+    "Hongrois": (
+        "nem tudom mire gondolsz de most azonnal mennünk kell "
+        "láttad ezt ez tényleg hihetetlen együtt megyünk oda "
+        "mi folyik itt miért nem mondtál nekem semmit sajnálom "
+        "meg kell találnunk a megoldást mielőtt túl késő lesz "
+        "még nem jött haza egyszer volt hol nem volt egy kis faluban "
+        "köszönöm szépen a segítségedet tényleg jó ember vagy "
+        "várj meg mindjárt visszajövök veletek mindig ugyanaz a helyzet "
+        "a gyerekek a kertben játszanak és a szüleik nézik őket"),
+}
+
+
+# Prix en dollars par million de tokens (entrée, sortie)
+MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "gpt-4": (30.00, 60.00),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+# Nombre maximal de tokens de sortie par requête (max_tokens accepté)
+MODEL_OUTPUT_LIMITS = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-4": 8192,
+    "gpt-4o": 16384,
+    "gpt-4o-mini": 16384,
+}
+# Limite prudente pour les modèles absents de la table (serveurs locaux...)
+DEFAULT_OUTPUT_LIMIT = 4096
+
+# Débit de génération approximatif (tokens de sortie par seconde)
+MODEL_OUTPUT_SPEEDS = {
+    "gpt-3.5-turbo": 80,
+    "gpt-4": 25,
+    "gpt-4o": 60,
+    "gpt-4o-mini": 80,
+}
+
+
+def format_duration(seconds: float) -> str:
+    """Afficher une durée en h/min/s"""
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600} h {seconds % 3600 // 60:02d} min"
+    if seconds >= 60:
+        return f"{seconds // 60} min {seconds % 60:02d} s"
+    return f"{seconds} s"
+
+
+def parse_reset_duration(value: str) -> float:
+    """Convertir une durée OpenAI ("1s", "6m0s", "20ms") en secondes"""
+    total = 0.0
+    for amount, unit in re.findall(r'([\d.]+)(ms|h|m|s)', value or ''):
+        factor = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}[unit]
+        total += float(amount) * factor
+    return total
+
+
+class AssLexer:
+    """Lecture des événements d'un script ASS en une seule passe
+
+    Le Format de chaque section [Events] n'est analysé qu'une fois ;
+    chaque ligne Dialogue: ou Comment: donne directement ses valeurs de
+    champs, le texte nettoyé (balises retirées, \\N changé en espace,
+    espaces réduits) et les positions des balises (ASS_TAG_PATTERN) dans
+    son champ Text.
+    """
+
+    EVENT_KINDS = ('Dialogue', 'Comment')
+
+    @staticmethod
+    def clean(text: str) -> tuple:
+        """(texte nettoyé, positions (début, fin) des balises de text)"""
+        if '{' not in text and '\\' not in text:
+            return ' '.join(text.split()), ()
+        parts = TAG_SPLIT_PATTERN.split(text)
+        bounds = tuple(accumulate(map(len, parts)))
+        spans = tuple(zip(bounds[0::2], bounds[1::2]))
+        if all(tag[0] == '{' for tag in parts[1::2]):
+            # Uniquement des blocs {...} : les morceaux de texte suffisent
+            cleaned = ''.join(parts[0::2])
+        else:
+            cleaned = OVERRIDE_BLOCK_PATTERN.sub('', text).replace('\\N', ' ')
+        return ' '.join(cleaned.split()), spans
+
+    def events(self, lines) -> Iterator[tuple]:
+        """Produire (numéro de ligne, type, champs, valeurs, texte, balises)
+
+        champs est le tuple du Format de la section, partagé par tous ses
+        événements ; les valeurs et le texte valent None pour un
+        événement sans Format ou aux champs incomplets. Les numéros de
+        ligne commencent à 0.
+        """
+        return self.events_from(enumerate(lines))
+
+    def events_from(self, items) -> Iterator[tuple]:
+        """Comme events, pour des paires (clé, ligne) : la clé remplace le numéro"""
+        in_events = False
+        fields = None
+        text_index = -1
+        max_split = 0
+        clean = self.clean
+
+        for number, line in items:
+            first = line[:1]
+            if first in ' \t':
+                line = line.lstrip()
+                first = line[:1]
+
+            if first == '[':
+                in_events = line.rstrip() == '[Events]'
+                fields = None
+                continue
+            if not in_events:
+                continue
+
+            if first == 'D' and line.startswith('Dialogue:'):
+                kind, body = 'Dialogue', line[9:]
+            elif first == 'C' and line.startswith('Comment:'):
+                kind, body = 'Comment', line[8:]
+            else:
+                if first == 'F' and line.startswith('Format:'):
+                    fields = tuple(field.strip()
+                                   for field in line[7:].split(','))
+                    text_index = (fields.index('Text') if 'Text' in fields
+                                  else -1)
+                    max_split = len(fields) - 1
+                continue
+
+            if fields is None:
+                yield number, kind, None, None, None, ()
+                continue
+            values = body.strip().split(',', max_split)
+            if len(values) < len(fields) or text_index < 0:
+                yield number, kind, fields, None, None, ()
+                continue
+            text, spans = clean(values[text_index])
+            yield number, kind, fields, values, text, spans
+
+
+class TagMask:
+    """Masquage des balises ASS par des marqueurs compacts
+
+    Les balises contiguës d'un champ Text forment une suite. Les suites
+    de début et de fin de ligne sont mises de côté et recollées autour de
+    la traduction ; chaque suite intérieure devient un marqueur {n} que
+    le modèle recopie à sa place. Les marqueurs restent reconnus par
+    ASS_TAG_PATTERN : la validation des balises s'y applique telle quelle.
+    """
+
+    @staticmethod
+    def has_break(run: str) -> bool:
+        """La suite contient-elle un retour à la ligne (\\N, \\n) ?"""
+        outside = OVERRIDE_BLOCK_PATTERN.sub('', run)
+        return '\\N' in outside or '\\n' in outside
+
+    @classmethod
+    def mask(cls, raw: str, spans: tuple) -> tuple:
+        """(texte masqué, suites) ; suites = [début, intérieures..., fin]"""
+        groups = []
+        for start, end in spans:
+            if groups and not raw[groups[-1][1]:start].strip():
+                groups[-1][1] = end
+            else:
+                groups.append([start, end])
+
+        prefix = suffix = ''
+        if groups and not raw[:groups[0][0]].strip():
+            prefix = raw[:groups[0][1]]
+            raw_start = groups.pop(0)[1]
+        else:
+            raw_start = 0
+        if groups and not raw[groups[-1][1]:].strip():
+            suffix = raw[groups[-1][0]:]
+            raw_end = groups.pop()[0]
+        else:
+            raw_end = len(raw)
+
+        pieces = []
+        runs = [prefix]
+        position = raw_start
+        for start, end in groups:
+            run = raw[start:end]
+            runs.append(run)
+            marker = f"{{{len(runs) - 1}}}"
+            pieces.append(raw[position:start])
+            # Un retour à la ligne sépare des mots : le marqueur aussi
+            pieces.append(f" {marker} " if cls.has_break(run) else marker)
+            position = end
+        pieces.append(raw[position:raw_end])
+        runs.append(suffix)
+        return ' '.join(''.join(pieces).split()), runs
+
+    @classmethod
+    def unmask(cls, translation: str, runs: List[str]) -> str:
+        """Remettre les balises d'origine à la place des marqueurs
+
+        Un marqueur inconnu ou répété est retiré ; les blocs {...} d'une
+        suite oubliée par le modèle sont ajoutés en fin de ligne, ses
+        retours à la ligne abandonnés.
+        """
+        interior = runs[1:-1]
+        used = set()
+
+        def restore(match):
+            number = int(match.group(2))
+            if not 1 <= number <= len(interior) or number in used:
+                return ''
+            used.add(number)
+            run = interior[number - 1]
+            if cls.has_break(run):
+                return run
+            return f"{match.group(1)}{run}{match.group(3)}"
+
+        body = PLACEHOLDER_PATTERN.sub(restore, translation)
+        missing = ''.join(block for number, run in enumerate(interior, 1)
+                          if number not in used
+                          for block in OVERRIDE_BLOCK_PATTERN.findall(run))
+        return f"{runs[0]}{body}{missing}{runs[-1]}"
+
+
+class AssReader:
+    """Lecture en flux d'un script ASS, sans le charger en mémoire
+
+    L'encodage est décidé au fil de la lecture : UTF-8 (BOM ou non) tant
+    que les octets sont valides, latin-1 à partir de la première ligne qui
+    ne l'est pas (fallback_start). Seuls les en-têtes de section et les
+    lignes de [Events] sont décodés et produits ; les autres sections
+    ([Fonts], [Graphics]...) sont parcourues sans être gardées.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.bom = False
+        self.fallback_start = None
+        self.size = 0
+        self.mtime = 0
+
+    def decode(self, raw: bytes, start: int) -> str:
+        """Décoder une ligne commençant à l'octet start"""
+        if self.fallback_start is None:
+            try:
+                return raw.decode('utf-8')
+            except UnicodeDecodeError:
+                self.fallback_start = start
+        return raw.decode('latin-1')
+
+    def lines(self) -> Iterator[tuple]:
+        """Produire ((début, fin), ligne) ; positions en octets, fin de ligne exclue"""
+        with open(self.path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.size, self.mtime = stat.st_size, stat.st_mtime_ns
+            in_events = False
+            position = 0
+            for raw in f:
+                start = position
+                position += len(raw)
+                if start == 0 and raw.startswith(codecs.BOM_UTF8):
+                    self.bom = True
+                    raw = raw[len(codecs.BOM_UTF8):]
+                    start = len(codecs.BOM_UTF8)
+                end = position
+                if raw.endswith(b'\n'):
+                    raw = raw[:-1]
+                    end -= 1
+                if raw.endswith(b'\r'):
+                    raw = raw[:-1]
+                    end -= 1
+
+                stripped = raw.lstrip()
+                if stripped[:1] == b'[':
+                    in_events = stripped.rstrip() == b'[Events]'
+                elif not in_events:
+                    # Section ignorée : seule la validité UTF-8 compte
+                    if self.fallback_start is None and not raw.isascii():
+                        self.decode(raw, start)
+                    continue
+                yield (start, end), self.decode(raw, start)
+
+
+class AssEventStore:
+    """Dialogues d'un script ASS rangés en colonnes
+
+    Une entrée par dialogue dans des tableaux parallèles : position de sa
+    ligne dans le fichier d'origine (octets, fin de ligne exclue), Format
+    de sa section, style (nom internalisé), action du tri, texte nettoyé,
+    langue détectée et, pour un dialogue à traduire qui a des balises, son
+    texte masqué et ses suites de balises (TagMask), calculés à la lecture.
+    Les valeurs des champs ne sont pas copiées : elles sont relues dans le
+    fichier à l'écriture.
+    """
+
+    # Suites d'un dialogue sans balises (ni début, ni fin, ni intérieur)
+    NO_RUNS = ('', '')
+
+    def __init__(self, path: str = None):
+        self.path = path
+        # Renseignés par AssReader en fin de lecture
+        self.bom = False
+        self.fallback_start = None
+        self.size = 0
+        self.mtime = 0
+        self.handle = None
+        self.formats = []
+        self.format_ids = array('H')
+        self.starts = array('q')
+        self.ends = array('q')
+        self.styles = []
+        self.actions = []
+        self.texts = []
+        self.languages = []
+        # Masquage des balises, None pour un dialogue sans balises
+        self.masked = []
+        self.runs = []
+        # Choisi par texts_to_translate : texte masqué ou texte brut envoyé
+        self.keep_tags = True
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def append(self, fields: tuple, start: int, end: int, style: str,
+               action: str, text: str, masked: str = None,
+               runs: List[str] = None):
+        """Ajouter un dialogue (fields est le tuple partagé du Format)"""
+        if not self.formats or self.formats[-1] is not fields:
+            self.formats.append(fields)
+        self.format_ids.append(len(self.formats) - 1)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.styles.append(sys.intern(style))
+        self.actions.append(action)
+        self.texts.append(text)
+        self.languages.append('')
+        self.masked.append(masked)
+        self.runs.append(runs)
+
+    def sent_text(self, index: int) -> str:
+        """Texte envoyé à la traduction ("" pour un dialogue copié/ignoré)"""
+        if self.actions[index] != 'translate':
+            return ''
+        if self.keep_tags and self.masked[index] is not None:
+            return self.masked[index]
+        return self.texts[index]
+
+    def tag_runs(self, index: int):
+        """Suites de balises à restaurer dans la traduction, None sinon
+
+        Un dialogue sans balises a des suites vides partagées : unmask y
+        retire encore les marqueurs {n} inventés par le modèle.
+        """
+        if not self.keep_tags:
+            return None
+        return self.runs[index] or self.NO_RUNS
+
+    def encoding_at(self, position: int) -> str:
+        """Encodage du fichier à l'octet position"""
+        if self.fallback_start is not None and position >= self.fallback_start:
+            return 'latin-1'
+        return 'utf-8'
+
+    def check_source(self):
+        """Vérifier que le fichier n'a pas changé depuis sa lecture"""
+        stat = os.stat(self.path)
+        if (stat.st_size, stat.st_mtime_ns) != (self.size, self.mtime):
+            raise ValueError("le fichier source a changé depuis l'analyse, "
+                             "analysez-le de nouveau")
+
+    def close(self):
+        """Fermer le fichier ouvert pour relire les champs"""
+        if self.handle:
+            self.handle.close()
+            self.handle = None
+
+    def values(self, index: int) -> List[str]:
+        """Valeurs des champs du dialogue index, relues dans le fichier"""
+        if self.handle is None:
+            self.handle = open(self.path, 'rb')
+        start = self.starts[index]
+        self.handle.seek(start)
+        line = self.handle.read(self.ends[index] - start).decode(
+            self.encoding_at(start))
+        fields = self.formats[self.format_ids[index]]
+        return line.lstrip()[9:].strip().split(',', len(fields) - 1)
+
+    def with_text(self, index: int, text: str) -> str:
+        """Ligne Dialogue: du dialogue index avec un autre champ Text"""
+        fields = self.formats[self.format_ids[index]]
+        values = self.values(index)
+        values[fields.index('Text')] = text
+        return f"Dialogue: {','.join(values)}"
+
+
+class TokenBucket:
+    """Seau à jetons rechargé en continu (capacité = limite par minute)"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(max(1, per_minute))
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        rate = self.capacity / 60.0
+        self.level = min(self.capacity,
+                         self.level + (now - self.updated) * rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / (self.capacity / 60.0)
+
+
+class RateLimiter:
+    """Ordonnanceur de requêtes respectant les limites requêtes/min et tokens/min
+
+    Les budgets sont recalés sur les en-têtes x-ratelimit-* renvoyés par
+    l'API, et un retry-after met en pause tous les workers à la fois.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, token_count: int):
+        """Bloquer jusqu'à ce qu'une requête de token_count tokens soit permise"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.requests.refill(now)
+                self.tokens.refill(now)
+                wait = max(self.paused_until - now,
+                           self.requests.wait_time(1),
+                           self.tokens.wait_time(token_count))
+                if wait <= 0:
+                    self.requests.level -= 1
+                    self.tokens.level -= min(token_count, self.tokens.capacity)
+                    return
+            time.sleep(min(wait, 5))
+
+    def pause(self, seconds: float):
+        """Suspendre toutes les requêtes pendant seconds secondes"""
+        with self.lock:
+            self.paused_until = max(self.paused_until,
+                                    time.monotonic() + seconds)
+
+    def update_from_headers(self, headers):
+        """Recaler les budgets sur les en-têtes de limite renvoyés par l'API"""
+        if not headers:
+            return
+        with self.lock:
+            now = time.monotonic()
+            for bucket, kind in ((self.requests, 'requests'),
+                                 (self.tokens, 'tokens')):
+                limit = headers.get(f'x-ratelimit-limit-{kind}')
+                remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+                reset = headers.get(f'x-ratelimit-reset-{kind}')
+                try:
+                    if limit:
+                        bucket.capacity = float(max(1, int(limit)))
+                    if remaining is not None:
+                        bucket.refill(now)
+                        bucket.level = min(bucket.level, float(remaining))
+                except ValueError:
+                    continue
+                if remaining == '0' and reset:
+                    self.paused_until = max(self.paused_until,
+                                            now + parse_reset_duration(reset))
+
+            retry_after = headers.get('retry-after')
+            if retry_after:
+                try:
+                    self.paused_until = max(self.paused_until,
+                                            now + float(retry_after))
+                except ValueError:
+                    pass
+
+
+class Endpoint:
+    """Point d'accès compatible OpenAI (URL, clé, modèle) et son état de santé"""
+
+    def __init__(self, name: str, base_url: str, api_key: str, model: str,
+                 weight: int, requests_per_minute: int, tokens_per_minute: int):
+        self.name = name
+        self.model = model
+        self.weight = max(1, weight)
+        # Les reprises sont gérées par call_api, pas par le SDK
+        self.client = openai.OpenAI(api_key=api_key or "sk-local",
+                                    base_url=base_url or None, max_retries=0)
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.outstanding = 0
+        self.current_weight = 0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.disabled = False
+        self.requests = 0
+        self.errors = 0
+
+    def serves(self, model: str) -> bool:
+        """Un modèle vide accepte tous les modèles, sinon seul le sien"""
+        return not self.model or self.model == model
+
+
+class EndpointPool:
+    """Répartition des requêtes entre plusieurs endpoints
+
+    Stratégies : round-robin pondéré (lissé) ou moins de requêtes en cours
+    rapportées au poids. Seuls les endpoints qui servent le modèle demandé
+    sont choisis (un endpoint au modèle fixé ne reçoit que ce modèle : cache,
+    rapports de tokens et limites restent ceux du modèle de la requête).
+    Un endpoint qui échoue max_failures fois de suite
+    est écarté pendant une durée qui double à chaque éjection ; une clé
+    refusée l'écarte pour toute la session. Le dernier endpoint disponible
+    n'est jamais écarté pour simple erreur.
+    """
+
+    def __init__(self, endpoints: List[Endpoint],
+                 strategy: str = 'least_outstanding',
+                 max_failures: int = 3, ejection_time: float = 30.0):
+        if not endpoints:
+            raise ValueError("Aucun endpoint configuré")
+        self.endpoints = endpoints
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.ejection_time = ejection_time
+        self.lock = threading.Lock()
+
+    def available(self, now: float) -> List[Endpoint]:
+        return [e for e in self.endpoints
+                if not e.disabled and e.ejected_until <= now]
+
+    def serving(self, model: str) -> List[Endpoint]:
+        """Endpoints actifs capables de servir un modèle"""
+        return [e for e in self.endpoints
+                if not e.disabled and e.serves(model)]
+
+    def has_alternative(self, endpoint: Endpoint, model: str = "") -> bool:
+        """Savoir si un autre endpoint peut encore prendre le relais"""
+        with self.lock:
+            return any(e is not endpoint for e in self.serving(model))
+
+    def acquire(self, model: str = "") -> Endpoint:
+        """Choisir un endpoint servant model (à rendre avec release)"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                candidates = [e for e in self.available(now) if e.serves(model)]
+                alive = self.serving(model)
+                if not alive:
+                    raise RuntimeError(
+                        f"Aucun endpoint actif ne sert le modèle {model}")
+
+                if candidates:
+                    if self.strategy == 'round_robin':
+                        total = sum(e.weight for e in candidates)
+                        for e in candidates:
+                            e.current_weight += e.weight
+                        best = max(candidates, key=lambda e: e.current_weight)
+                        best.current_weight -= total
+                    else:
+                        best = min(candidates,
+                                   key=lambda e: ((e.outstanding + 1) / e.weight,
+                                                  e.requests / e.weight))
+                    best.outstanding += 1
+                    best.requests += 1
+                    return best
+
+                wait = min(e.ejected_until for e in alive) - now
+            time.sleep(min(max(wait, 0.05), 5))
+
+    def release(self, endpoint: Endpoint, ok: bool = True,
+                fatal: bool = False):
+        """Rendre un endpoint et mettre à jour son état de santé"""
+        with self.lock:
+            endpoint.outstanding = max(0, endpoint.outstanding - 1)
+            if ok:
+                endpoint.failures = 0
+                endpoint.ejections = 0
+                return
+
+            endpoint.errors += 1
+            if fatal:
+                endpoint.disabled = True
+                print(f"Endpoint {endpoint.name} désactivé (clé ou modèle refusé)")
+                return
+
+            endpoint.failures += 1
+            now = time.monotonic()
+            others = [e for e in self.available(now) if e is not endpoint]
+            if endpoint.failures >= self.max_failures and others:
+                endpoint.ejections += 1
+                duration = min(600.0, self.ejection_time *
+                               2 ** (endpoint.ejections - 1))
+                endpoint.ejected_until = now + duration
+                endpoint.failures = 0
+                print(f"Endpoint {endpoint.name} écarté pendant {duration:.0f}s")
+
+    def summary(self) -> str:
+        """Résumé de la répartition des requêtes par endpoint"""
+        parts = []
+        for e in self.endpoints:
+            state = " ✖" if e.disabled else ""
+            parts.append(f"{e.name}: {e.requests}"
+                         + (f" ({e.errors} err.)" if e.errors else "") + state)
+        return ", ".join(parts)
+
+
+class RequestCancelled(Exception):
+    """Requête abandonnée car une requête concurrente a déjà répondu"""
+
+
+class RequestHedger:
+    """Relance en double les lots anormalement lents
+
+    La latence des lots terminés est mémorisée par ligne ; un lot qui
+    dépasse le percentile choisi (rapporté à sa taille) reçoit une requête
+    de secours. Les tokens de ces doublons sont plafonnés à une fraction
+    token_budget de l'estimation totale du fichier.
+    """
+
+    def __init__(self, percentile: float, token_budget: int, model: str = "",
+                 max_workers: int = 8, min_samples: int = 8):
+        self.percentile = percentile
+        self.token_budget = token_budget
+        self.model = model
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=200)
+        self.extra_tokens = 0
+        self.hedges = 0
+        self.wins = 0
+        self.lock = threading.Lock()
+        # Requête principale et doublon tournent ici, le worker ne fait qu'attendre
+        self.executor = ThreadPoolExecutor(max_workers=max_workers * 2)
+
+    def record(self, seconds: float, line_count: int):
+        """Mémoriser la latence d'un lot terminé"""
+        with self.lock:
+            self.latencies.append(seconds / max(1, line_count))
+
+    def threshold(self, line_count: int):
+        """Délai avant doublon pour un lot, None tant que l'historique est court"""
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        rank = int(self.percentile * (len(ordered) - 1))
+        return ordered[rank] * max(1, line_count)
+
+    def reserve(self, token_count: int) -> bool:
+        """Réserver le budget d'un doublon (False si le plafond est atteint)"""
+        with self.lock:
+            if self.extra_tokens + token_count > self.token_budget:
+                return False
+            self.extra_tokens += token_count
+            self.hedges += 1
+            return True
+
+    def record_win(self):
+        with self.lock:
+            self.wins += 1
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class TranslationValidator:
+    """Contrôle des traductions reçues, ligne par ligne et sur tout le fichier
+
+    Règles par ligne : vide, identique à la source, mauvaise écriture pour
+    la langue cible, balises déséquilibrées, numérotation restée en tête,
+    rapport de longueur hors bornes. Sur l'ensemble du fichier, les
+    rapports de longueur très éloignés de la médiane (en écarts absolus
+    médians) sont aussi signalés.
+    """
+
+    def __init__(self, min_ratio: float = 0.25, max_ratio: float = 4.0,
+                 outlier_factor: float = 4.0):
+        self.min_ratio = min_ratio
+        self.max_ratio = max_ratio
+        self.outlier_factor = outlier_factor
+
+    def script_share(self, text: str, scripts: tuple) -> float:
+        """Part des lettres de text écrites dans l'une des écritures données"""
+        letters = [char for char in text if char.isalpha()]
+        if len(letters) < 4:
+            return 1.0
+        matching = sum(1 for char in letters
+                       if unicodedata.name(char, '').startswith(scripts))
+        return matching / len(letters)
+
+    def check_line(self, source: str, translation: str, target: str) -> str:
+        """Retourner la raison du rejet d'une ligne, "" si elle est valide"""
+        if not translation.strip():
+            return "vide"
+
+        if (translation.strip().casefold() == source.strip().casefold()
+                and len(re.findall(r'\w+', source)) >= 2):
+            return "identique à la source"
+
+        if (LEFTOVER_NUMBER_PATTERN.match(translation)
+                and not LEFTOVER_NUMBER_PATTERN.match(source)):
+            return "numérotation restée en tête"
+
+        if (sorted(ASS_TAG_PATTERN.findall(source)) !=
+                sorted(ASS_TAG_PATTERN.findall(translation)) or
+                translation.count('{') != translation.count('}')):
+            return "balises déséquilibrées"
+
+        scripts = LANGUAGE_SCRIPTS.get(target)
+        if scripts and self.script_share(translation, scripts) < 0.5:
+            return f"écriture inattendue pour {target}"
+
+        if len(source) >= 10:
+            ratio = len(translation) / len(source)
+            if ratio < self.min_ratio or ratio > self.max_ratio:
+                return f"longueur anormale (x{ratio:.2f})"
+
+        return ""
+
+    def validate(self, items: List[tuple]) -> Dict:
+        """Valider des quadruplets (clé, source, traduction, langue)
+
+        Retourne {clé: raison} pour les lignes rejetées.
+        """
+        flagged = {}
+        ratios = {}
+        for key, source, translation, target in items:
+            reason = self.check_line(source, translation, target)
+            if reason:
+                flagged[key] = reason
+            elif len(source) >= 10:
+                ratios.setdefault(target, []).append(
+                    (key, math.log(len(translation) / len(source))))
+
+        # Écarts à la médiane par langue (les langues n'ont pas la même densité)
+        for values in ratios.values():
+            if len(values) < 20:
+                continue
+            ordered = sorted(value for _, value in values)
+            median = ordered[len(ordered) // 2]
+            deviations = sorted(abs(value - median) for value in ordered)
+            spread = max(deviations[len(deviations) // 2] * 1.4826,
+                         math.log(2.5) / self.outlier_factor)
+            for key, value in values:
+                if abs(value - median) > self.outlier_factor * spread:
+                    flagged[key] = (f"longueur atypique (x{math.exp(value):.2f}, "
+                                    f"médiane x{math.exp(median):.2f})")
+        return flagged
+
+
+class LanguageIdentifier:
+    """Identification hors ligne de la langue d'une ligne de dialogue
+
+    Les langues à écriture propre sont reconnues à leur écriture ; les
+    langues latines par un modèle de trigrammes de caractères appris au
+    démarrage sur LANGUAGE_SAMPLES (log-probabilités lissées, moyennées
+    par trigramme). Une ligne n'est attribuée à une autre langue que la
+    source que si son score dépasse celui de la source d'au moins margin.
+    """
+
+    def __init__(self, samples: Dict[str, str] = None, margin: float = 0.3,
+                 min_letters: int = 8):
+        self.margin = margin
+        self.min_letters = min_letters
+        counts = {}
+        for language, sample in (samples or LANGUAGE_SAMPLES).items():
+            grams = counts.setdefault(language, {})
+            for gram in self.trigrams(sample):
+                grams[gram] = grams.get(gram, 0) + 1
+
+        # Lissage additif sur le vocabulaire commun à toutes les langues
+        vocabulary = len(set().union(*counts.values()))
+        self.profiles = {}
+        for language, grams in counts.items():
+            total = sum(grams.values()) + 0.5 * vocabulary
+            self.profiles[language] = (
+                {gram: math.log((n + 0.5) / total) for gram, n in grams.items()},
+                math.log(0.5 / total))
+
+    @staticmethod
+    def trigrams(text: str) -> List[str]:
+        """Trigrammes de caractères des mots de text (minuscules, bornés par des espaces)"""
+        words = ''.join(char if char.isalpha() else ' '
+                        for char in text.lower()).split()
+        padded = f" {' '.join(words)} "
+        return [padded[n:n + 3] for n in range(len(padded) - 2)]
+
+    def scores(self, text: str) -> Dict[str, float]:
+        """Log-probabilité moyenne par trigramme de text pour chaque langue latine"""
+        grams = self.trigrams(text)
+        return {language: sum(probs.get(gram, unseen) for gram in grams) / len(grams)
+                for language, (probs, unseen) in self.profiles.items()}
+
+    def identify(self, text: str, source: str) -> str:
+        """Langue de text, "" si elle ne peut pas être déterminée
+
+        Une ligne latine trop courte ou trop proche de la source est
+        attribuée à la source ; une ligne en idéogrammes seuls l'est aussi
+        quand la source est le japonais, le chinois ou le coréen.
+        """
+        families = {}
+        for char in text:
+            if char.isalpha():
+                family = unicodedata.name(char, '').split(' ')[0]
+                if family in ("HIRAGANA", "KATAKANA"):
+                    families['KANA'] = families.get('KANA', 0) + 1
+                    family = "CJK"
+                families[family] = families.get(family, 0) + 1
+        letters = sum(count for family, count in families.items()
+                      if family != 'KANA')
+        if letters < 2:
+            return ""
+        family = max((f for f in families if f != 'KANA'), key=families.get)
+        if families[family] < 0.8 * letters:
+            return ""
+
+        if family == "CJK":
+            if families.get('KANA'):
+                return "Japonais"
+            if source in ("Japonais", "Chinois", "Coréen"):
+                return source
+            return "Chinois"
+        if family != "LATIN":
+            return SCRIPT_LANGUAGES.get(family, "")
+
+        if letters < self.min_letters:
+            return source if source in self.profiles else ""
+        scores = self.scores(text)
+        best = max(scores, key=scores.get)
+        if source in scores:
+            if scores[best] - scores[source] < self.margin:
+                return source
+            return best
+        ranked = sorted(scores.values(), reverse=True)
+        return best if ranked[0] - ranked[1] >= self.margin else ""
+
+    @staticmethod
+    def keep_as_is(language: str, source: str, target: str) -> bool:
+        """Une ligne de cette langue doit-elle être recopiée sans traduction ?
+
+        Oui si elle est déjà dans la langue cible, ou écrite dans une
+        écriture que la langue source n'utilise pas (paroles en kanji d'un
+        fichier anglais, panneau en cyrillique...).
+        """
+        if not language or language == source:
+            return False
+        if language == target:
+            return True
+        return not (set(LANGUAGE_SCRIPTS.get(language, ())) &
+                    set(LANGUAGE_SCRIPTS.get(source, ())))
+
+
+class TokenRatioStats:
+    """Rapports tokens de sortie / tokens d'entrée par langues et modèle
+
+    Appris sur response.usage à chaque lot (l'entrée est l'estimation locale
+    du contenu utilisateur, celle qui sert à dimensionner max_tokens) et
+    conservés dans un fichier JSON d'une exécution à l'autre.
+    """
+
+    def __init__(self, path: str, max_samples: int = 200, min_samples: int = 5):
+        self.path = path
+        self.max_samples = max_samples
+        self.min_samples = min_samples
+        self.samples = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.samples = json.load(f)
+            except (OSError, ValueError):
+                self.samples = {}
+
+    @staticmethod
+    def make_key(source_lang: str, targets: List[str], model: str,
+                 json_mode: bool) -> str:
+        return "|".join([source_lang, "+".join(targets), model,
+                         "json" if json_mode else "text"])
+
+    def observe(self, key: str, input_tokens: int, output_tokens: int,
+                truncated: bool = False):
+        """Enregistrer un lot ; une réponse tronquée compte comme un rapport majoré"""
+        if input_tokens <= 0 or not output_tokens:
+            return
+        ratio = output_tokens / input_tokens
+        if truncated:
+            ratio *= 1.5
+        with self.lock:
+            values = self.samples.setdefault(key, [])
+            values.append(round(ratio, 4))
+            del values[:-self.max_samples]
+
+    def ratio(self, key: str, percentile: float):
+        """Rapport au percentile donné, None tant que l'historique est court"""
+        with self.lock:
+            values = sorted(self.samples.get(key, []))
+        if len(values) < self.min_samples:
+            return None
+        return values[min(len(values) - 1, int(percentile * len(values)))]
+
+    def save(self):
+        with self.lock:
+            data = json.dumps(self.samples)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(data)
+
+
+class TranslationMemory:
+    """Mémoire de traduction persistante (SQLite) avec éviction par âge/taille"""
+
+    def __init__(self, path: str, max_entries: int = 200000,
+                 max_age_days: int = 180):
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS memory (
+                                 key TEXT PRIMARY KEY,
+                                 translation TEXT NOT NULL,
+                                 created REAL NOT NULL,
+                                 last_used REAL NOT NULL)""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS memory_last_used "
+                          "ON memory (last_used)")
+
+    @staticmethod
+    def make_key(source_lang: str, target_lang: str, model: str,
+                 prompt: str, text: str) -> str:
+        """Clé de cache stable pour (source, cible, modèle, prompt, texte)"""
+        raw = "\x1f".join((source_lang, target_lang, model, prompt, text))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def lookup(self, keys: List[str]) -> Dict[str, str]:
+        """Retourner les traductions connues pour les clés données"""
+        found = {}
+        keys = list(keys)
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT key, translation FROM memory "
+                f"WHERE key IN ({placeholders})", chunk)
+            found.update(rows.fetchall())
+
+        if found:
+            now = time.time()
+            self.conn.executemany(
+                "UPDATE memory SET last_used = ? WHERE key = ?",
+                [(now, key) for key in found])
+            self.conn.commit()
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def store(self, items: List[tuple]):
+        """Enregistrer des paires (clé, traduction)"""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO memory VALUES (?, ?, ?, ?)",
+            [(key, translation, now, now) for key, translation in items])
+        self.conn.commit()
+
+    def evict(self):
+        """Supprimer les entrées trop anciennes puis les moins utilisées"""
+        cutoff = time.time() - self.max_age_days * 86400
+        self.conn.execute("DELETE FROM memory WHERE last_used < ?", (cutoff,))
+        count = self.conn.execute("SELECT COUNT(*) FROM memory").fetchone()[0]
+        if count > self.max_entries:
+            self.conn.execute(
+                "DELETE FROM memory WHERE key IN (SELECT key FROM memory "
+                "ORDER BY last_used LIMIT ?)", (count - self.max_entries,))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class TranslationJournal:
+    """Journal append-only des lots terminés, pour reprendre une traduction"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @staticmethod
+    def make_key(filename: str, settings: Dict) -> str:
+        """Clé du journal : contenu du fichier source + réglages de traduction"""
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def load(self) -> Dict[tuple, str]:
+        """Relire les traductions déjà journalisées ((langue, index) -> traduction)"""
+        done = {}
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Dernière ligne tronquée par un arrêt brutal
+                    continue
+                done[(entry['l'], entry['i'])] = entry['t']
+        return done
+
+    def append(self, items: List[tuple]):
+        """Ajouter les triplets (index, langue, traduction) d'un lot terminé"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for index, language, translation in items:
+                f.write(json.dumps({'i': index, 'l': language,
+                                    't': translation},
+                                   ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
 
 
 class AssTranslator:
@@ -36,10 +1255,75 @@ class AssTranslator:
         self.target_lang = tk.StringVar(value="Français")
         self.model_choice = tk.StringVar(value="gpt-3.5-turbo")
         self.batch_size_var = tk.IntVar(value=10)
-        self.subtitle_lines = []
+        self.concurrency_var = tk.IntVar(value=4)
+        self.rpm_limit = 500
+        self.tpm_limit = 60000
+        self.max_retries = 5
+        self.failed_indices = []
+        self.use_cache_var = tk.BooleanVar(value=True)
+        self.cache_max_entries = 200000
+        self.cache_max_age_days = 180
+        self.cache_stats = (0, 0)
+        self.duplicate_count = 0
+        self.token_packing_var = tk.BooleanVar(value=False)
+        self.batch_input_tokens = 1500
+        self.batch_output_tokens = 2500
+        self.stream_var = tk.BooleanVar(value=True)
+        self.json_mode_var = tk.BooleanVar(value=False)
+        self.series_var = tk.StringVar()
+        self.extra_targets = []
+        self.base_url = ""
+        self.endpoints = []
+        self.endpoint_strategy = 'least_outstanding'
+        self.endpoint_summary = ""
+        self.batch_job_var = tk.BooleanVar(value=False)
+        self.hedge_var = tk.BooleanVar(value=False)
+        self.hedge_percentile = 0.95
+        self.hedge_max_ratio = 0.1
+        self.hedge_model = ""
+        self.hedge_stats = (0, 0, 0)
+        self.cascade_var = tk.BooleanVar(value=False)
+        self.cascade_model = "gpt-3.5-turbo"
+        self.cascade_stats = {'lines': 0, 'escalated': 0}
+        self.validator = TranslationValidator()
+        self.validate_var = tk.BooleanVar(value=True)
+        self.validation_rounds = 1
+        self.validation_stats = (0, 0)
+        self.suspect_indices = []
+        self.max_tokens_percentile = 0.95
+        self.tokenizers = {}
+        self.comment_count = 0
+        self.keep_tags_var = tk.BooleanVar(value=True)
+        self.language_id_var = tk.BooleanVar(value=True)
+        self.language_identifier = LanguageIdentifier()
+        self.language_kept = 0
+        self.triage_rules = {
+            'drawings': 'skip',
+            'karaoke': 'copy',
+            'no_letters': 'copy',
+            'copy_styles': r'(?i)romaji|kanji|karaok|^kara|^fx',
+            'skip_styles': ''
+        }
+        self.batch_poll_interval = 30
+        self.translated_sets = {}
+        self.usage_stats = {'prompt': 0, 'completion': 0, 'cached': 0}
+        self.usage_lock = threading.Lock()
+        self.subtitle_lines = AssEventStore()
         self.translated_lines = []
 
         self.config_file = "translator_config.ini"
+        self.cache_file = os.path.join(
+            os.path.dirname(os.path.abspath(self.config_file)),
+            "translation_memory.db")
+        self.journal_dir = os.path.join(
+            os.path.dirname(os.path.abspath(self.config_file)),
+            "translation_journals")
+        self.token_ratios = TokenRatioStats(os.path.join(
+            os.path.dirname(os.path.abspath(self.config_file)),
+            "token_ratios.json"))
+        self.glossary_dir = os.path.join(
+            os.path.dirname(os.path.abspath(self.config_file)),
+            "glossaries")
         self.load_config()
 
         self.languages = [
@@ -197,20 +1481,151 @@ class AssTranslator:
             if 'API' in config:
                 if 'openai_key' in config['API']:
                     self.api_key.set(config['API']['openai_key'])
+                if 'base_url' in config['API']:
+                    self.base_url = config['API']['base_url']
+            if 'ENDPOINTS' in config:
+                # nom = base_url, clé, modèle, poids (modèle vide = modèle choisi)
+                self.endpoints = []
+                for name, value in config['ENDPOINTS'].items():
+                    fields = [field.strip() for field in value.split(',')]
+                    fields += [''] * (4 - len(fields))
+                    base_url, key, model, weight = fields[:4]
+                    self.endpoints.append({
+                        'name': name, 'base_url': base_url, 'key': key,
+                        'model': model, 'weight': int(weight or 1)
+                    })
+            if 'TRIAGE' in config:
+                for rule, value in config['TRIAGE'].items():
+                    if rule not in self.triage_rules:
+                        continue
+                    if rule.endswith('_styles') or value in TRIAGE_ACTIONS:
+                        self.triage_rules[rule] = value
             if 'SETTINGS' in config:
                 if 'model' in config['SETTINGS']:
                     self.model_choice.set(config['SETTINGS']['model'])
                 if 'batch_size' in config['SETTINGS']:
                     batch_val = int(config['SETTINGS']['batch_size'])
                     self.batch_size_var.set(batch_val)
+                if 'concurrency' in config['SETTINGS']:
+                    concurrency = int(config['SETTINGS']['concurrency'])
+                    self.concurrency_var.set(concurrency)
+                if 'rpm_limit' in config['SETTINGS']:
+                    self.rpm_limit = int(config['SETTINGS']['rpm_limit'])
+                if 'tpm_limit' in config['SETTINGS']:
+                    self.tpm_limit = int(config['SETTINGS']['tpm_limit'])
+                if 'max_retries' in config['SETTINGS']:
+                    self.max_retries = int(config['SETTINGS']['max_retries'])
+                if 'endpoint_strategy' in config['SETTINGS']:
+                    self.endpoint_strategy = config['SETTINGS']['endpoint_strategy']
+                if 'token_packing' in config['SETTINGS']:
+                    token_packing = config['SETTINGS'].getboolean('token_packing')
+                    self.token_packing_var.set(token_packing)
+                if 'batch_input_tokens' in config['SETTINGS']:
+                    self.batch_input_tokens = int(
+                        config['SETTINGS']['batch_input_tokens'])
+                if 'batch_output_tokens' in config['SETTINGS']:
+                    self.batch_output_tokens = int(
+                        config['SETTINGS']['batch_output_tokens'])
+                if 'stream' in config['SETTINGS']:
+                    stream = config['SETTINGS'].getboolean('stream')
+                    self.stream_var.set(stream)
+                if 'json_mode' in config['SETTINGS']:
+                    json_mode = config['SETTINGS'].getboolean('json_mode')
+                    self.json_mode_var.set(json_mode)
+                if 'extra_targets' in config['SETTINGS']:
+                    extra = config['SETTINGS']['extra_targets'].split(',')
+                    self.extra_targets = [t.strip() for t in extra if t.strip()]
+                if 'batch_job' in config['SETTINGS']:
+                    batch_job = config['SETTINGS'].getboolean('batch_job')
+                    self.batch_job_var.set(batch_job)
+                if 'max_tokens_percentile' in config['SETTINGS']:
+                    self.max_tokens_percentile = float(
+                        config['SETTINGS']['max_tokens_percentile'])
+                if 'validate' in config['SETTINGS']:
+                    validate = config['SETTINGS'].getboolean('validate')
+                    self.validate_var.set(validate)
+                if 'validation_rounds' in config['SETTINGS']:
+                    self.validation_rounds = int(
+                        config['SETTINGS']['validation_rounds'])
+                if 'keep_tags' in config['SETTINGS']:
+                    keep_tags = config['SETTINGS'].getboolean('keep_tags')
+                    self.keep_tags_var.set(keep_tags)
+                if 'language_id' in config['SETTINGS']:
+                    language_id = config['SETTINGS'].getboolean('language_id')
+                    self.language_id_var.set(language_id)
+                if 'language_id_margin' in config['SETTINGS']:
+                    self.language_identifier.margin = float(
+                        config['SETTINGS']['language_id_margin'])
+                if 'cascade' in config['SETTINGS']:
+                    cascade = config['SETTINGS'].getboolean('cascade')
+                    self.cascade_var.set(cascade)
+                if 'cascade_model' in config['SETTINGS']:
+                    self.cascade_model = config['SETTINGS']['cascade_model']
+                if 'hedge' in config['SETTINGS']:
+                    hedge = config['SETTINGS'].getboolean('hedge')
+                    self.hedge_var.set(hedge)
+                if 'hedge_percentile' in config['SETTINGS']:
+                    self.hedge_percentile = float(
+                        config['SETTINGS']['hedge_percentile'])
+                if 'hedge_max_ratio' in config['SETTINGS']:
+                    self.hedge_max_ratio = float(
+                        config['SETTINGS']['hedge_max_ratio'])
+                if 'hedge_model' in config['SETTINGS']:
+                    self.hedge_model = config['SETTINGS']['hedge_model']
+                if 'batch_poll_interval' in config['SETTINGS']:
+                    self.batch_poll_interval = int(
+                        config['SETTINGS']['batch_poll_interval'])
+                if 'use_cache' in config['SETTINGS']:
+                    use_cache = config['SETTINGS'].getboolean('use_cache')
+                    self.use_cache_var.set(use_cache)
+                if 'cache_max_entries' in config['SETTINGS']:
+                    self.cache_max_entries = int(
+                        config['SETTINGS']['cache_max_entries'])
+                if 'cache_max_age_days' in config['SETTINGS']:
+                    self.cache_max_age_days = int(
+                        config['SETTINGS']['cache_max_age_days'])
 
     def save_config(self):
         """Sauvegarder la configuration dans le fichier INI"""
         config = configparser.ConfigParser()
-        config['API'] = {'openai_key': self.api_key.get()}
+        config['API'] = {'openai_key': self.api_key.get(),
+                         'base_url': self.base_url}
         config['SETTINGS'] = {
             'model': self.model_choice.get(),
-            'batch_size': str(self.batch_size_var.get())
+            'batch_size': str(self.batch_size_var.get()),
+            'concurrency': str(self.concurrency_var.get()),
+            'rpm_limit': str(self.rpm_limit),
+            'tpm_limit': str(self.tpm_limit),
+            'max_retries': str(self.max_retries),
+            'endpoint_strategy': self.endpoint_strategy,
+            'token_packing': str(self.token_packing_var.get()),
+            'batch_input_tokens': str(self.batch_input_tokens),
+            'batch_output_tokens': str(self.batch_output_tokens),
+            'stream': str(self.stream_var.get()),
+            'json_mode': str(self.json_mode_var.get()),
+            'extra_targets': ','.join(self.extra_targets),
+            'batch_job': str(self.batch_job_var.get()),
+            'max_tokens_percentile': str(self.max_tokens_percentile),
+            'validate': str(self.validate_var.get()),
+            'validation_rounds': str(self.validation_rounds),
+            'keep_tags': str(self.keep_tags_var.get()),
+            'language_id': str(self.language_id_var.get()),
+            'language_id_margin': str(self.language_identifier.margin),
+            'cascade': str(self.cascade_var.get()),
+            'cascade_model': self.cascade_model,
+            'hedge': str(self.hedge_var.get()),
+            'hedge_percentile': str(self.hedge_percentile),
+            'hedge_max_ratio': str(self.hedge_max_ratio),
+            'hedge_model': self.hedge_model,
+            'batch_poll_interval': str(self.batch_poll_interval),
+            'use_cache': str(self.use_cache_var.get()),
+            'cache_max_entries': str(self.cache_max_entries),
+            'cache_max_age_days': str(self.cache_max_age_days)
+        }
+        config['TRIAGE'] = dict(self.triage_rules)
+        config['ENDPOINTS'] = {
+            e['name']: f"{e['base_url']}, {e['key']}, {e['model']}, {e['weight']}"
+            for e in self.endpoints
         }
         with open(self.config_file, 'w') as f:
             config.write(f)
@@ -309,6 +1724,23 @@ class AssTranslator:
                                 command=self.select_file)
         browse_btn.pack(side=tk.RIGHT)
 
+        series_frame = tk.Frame(file_card, bg=self.colors['bg_secondary'])
+        series_frame.pack(fill=tk.X, pady=(10, 0))
+
+        tk.Label(series_frame, text="📺 Série",
+                font=("Segoe UI", 10, "bold"),
+                fg=self.colors['text_primary'],
+                bg=self.colors['bg_secondary']).pack(side=tk.LEFT, padx=(0, 10))
+
+        series_entry = ttk.Entry(series_frame, textvariable=self.series_var,
+                                 style="Discord.TEntry", width=30)
+        series_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 10))
+
+        glossary_btn = ttk.Button(series_frame, text="📖 Glossaire",
+                                  style="DiscordSecondary.TButton",
+                                  command=self.edit_glossary)
+        glossary_btn.pack(side=tk.RIGHT)
+
 
         config_section = self.create_modern_section(main_frame, "⚙️ Configuration de traduction")
         
@@ -346,7 +1778,19 @@ class AssTranslator:
         target_combo = ttk.Combobox(target_frame, textvariable=self.target_lang,
                                     values=self.languages, state="readonly",
                                    style="Discord.TCombobox", width=20)
-        target_combo.pack(anchor=tk.W, pady=(5, 15))
+        target_combo.pack(anchor=tk.W, pady=(5, 0))
+
+        self.extra_targets_label = tk.Label(target_frame,
+                                            text=self.describe_extra_targets(),
+                                            font=("Segoe UI", 9),
+                                            fg=self.colors['text_secondary'],
+                                            bg=self.colors['bg_secondary'])
+        self.extra_targets_label.pack(anchor=tk.W, pady=(5, 0))
+
+        extra_btn = ttk.Button(target_frame, text="➕ Autres langues",
+                               style="DiscordSecondary.TButton",
+                               command=self.select_extra_targets)
+        extra_btn.pack(anchor=tk.W, pady=(5, 15))
         
 
         advanced_frame = tk.Frame(config_container, bg=self.colors['bg_secondary'])
@@ -380,6 +1824,21 @@ class AssTranslator:
                                 width=8, state="readonly",
                                 font=("Segoe UI", 10))
         batch_spin.pack(anchor=tk.W, pady=(5, 0))
+
+
+        concurrency_frame = tk.Frame(advanced_frame, bg=self.colors['bg_secondary'])
+        concurrency_frame.pack(side=tk.RIGHT, fill=tk.X, expand=True, padx=(10, 0))
+
+        tk.Label(concurrency_frame, text="⚡ Requêtes simultanées",
+                font=("Segoe UI", 10, "bold"),
+                fg=self.colors['text_primary'],
+                bg=self.colors['bg_secondary']).pack(anchor=tk.W)
+
+        concurrency_spin = ttk.Spinbox(concurrency_frame, from_=1, to=16,
+                                       textvariable=self.concurrency_var,
+                                       width=8, state="readonly",
+                                       font=("Segoe UI", 10))
+        concurrency_spin.pack(anchor=tk.W, pady=(5, 0))
         
 
         cost_info_frame = tk.Frame(config_container, bg=self.colors['bg_secondary'])
@@ -392,6 +1851,79 @@ class AssTranslator:
                             bg=self.colors['bg_secondary'])
         cost_info.pack(anchor=tk.W)
 
+        cache_check = ttk.Checkbutton(cost_info_frame,
+                                      text="💾 Mémoire de traduction "
+                                           "(réutilise les lignes déjà traduites)",
+                                      variable=self.use_cache_var,
+                                      style="Discord.TCheckbutton")
+        cache_check.pack(anchor=tk.W, pady=(10, 0))
+
+        packing_check = ttk.Checkbutton(cost_info_frame,
+                                        text="📐 Lots remplis par budget de "
+                                             "tokens (ignore Lignes par lot)",
+                                        variable=self.token_packing_var,
+                                        style="Discord.TCheckbutton")
+        packing_check.pack(anchor=tk.W, pady=(5, 0))
+
+        stream_check = ttk.Checkbutton(cost_info_frame,
+                                       text="📡 Réponses en flux (aperçu ligne "
+                                            "par ligne)",
+                                       variable=self.stream_var,
+                                       style="Discord.TCheckbutton")
+        stream_check.pack(anchor=tk.W, pady=(5, 0))
+
+        json_check = ttk.Checkbutton(cost_info_frame,
+                                     text="🧾 Réponses JSON identifiées par ligne "
+                                          "(modèles compatibles JSON)",
+                                     variable=self.json_mode_var,
+                                     style="Discord.TCheckbutton")
+        json_check.pack(anchor=tk.W, pady=(5, 0))
+
+        batch_job_check = ttk.Checkbutton(cost_info_frame,
+                                          text="🌙 Job différé via la Batch API "
+                                               "(~50 % moins cher, résultats "
+                                               "sous 24 h)",
+                                          variable=self.batch_job_var,
+                                          style="Discord.TCheckbutton")
+        batch_job_check.pack(anchor=tk.W, pady=(5, 0))
+
+        validate_check = ttk.Checkbutton(cost_info_frame,
+                                         text="🔍 Vérifier les traductions et "
+                                              "relancer les lignes rejetées",
+                                         variable=self.validate_var,
+                                         style="Discord.TCheckbutton")
+        validate_check.pack(anchor=tk.W, pady=(5, 0))
+
+        tags_check = ttk.Checkbutton(cost_info_frame,
+                                     text="🏷️ Conserver les balises (italique, "
+                                          "position, retours à la ligne)",
+                                     variable=self.keep_tags_var,
+                                     style="Discord.TCheckbutton")
+        tags_check.pack(anchor=tk.W, pady=(5, 0))
+
+        language_check = ttk.Checkbutton(cost_info_frame,
+                                         text="🔤 Garder telles quelles les lignes "
+                                              "déjà dans la langue cible "
+                                              "(détection locale)",
+                                         variable=self.language_id_var,
+                                         style="Discord.TCheckbutton")
+        language_check.pack(anchor=tk.W, pady=(5, 0))
+
+        cascade_check = ttk.Checkbutton(cost_info_frame,
+                                        text=f"🪜 Cascade : {self.cascade_model} "
+                                             f"d'abord, modèle choisi pour les "
+                                             f"lignes en échec",
+                                        variable=self.cascade_var,
+                                        style="Discord.TCheckbutton")
+        cascade_check.pack(anchor=tk.W, pady=(5, 0))
+
+        hedge_check = ttk.Checkbutton(cost_info_frame,
+                                      text="🏁 Doubler les lots anormalement lents "
+                                           "(coût supplémentaire plafonné)",
+                                      variable=self.hedge_var,
+                                      style="Discord.TCheckbutton")
+        hedge_check.pack(anchor=tk.W, pady=(5, 0))
+
 
         preview_section = self.create_modern_section(main_frame, "👁️ Aperçu des traductions")
         
@@ -535,6 +2067,47 @@ class AssTranslator:
 
         self.root.after(100, self.center_window)
 
+    def describe_extra_targets(self) -> str:
+        """Résumé des langues cibles supplémentaires"""
+        if not self.extra_targets:
+            return "Aucune langue supplémentaire"
+        return "Aussi : " + ", ".join(self.extra_targets)
+
+    def select_extra_targets(self):
+        """Choisir des langues cibles traduites dans la même passe"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("🌐 Langues supplémentaires")
+        dialog.configure(bg=self.colors['bg_primary'])
+        dialog.transient(self.root)
+        dialog.grab_set()
+
+        tk.Label(dialog, text="Chaque lot est traduit dans toutes ces langues "
+                              "en une seule requête",
+                 font=("Segoe UI", 9),
+                 fg=self.colors['text_secondary'],
+                 bg=self.colors['bg_primary']).pack(anchor=tk.W, padx=15,
+                                                    pady=(15, 10))
+
+        grid = tk.Frame(dialog, bg=self.colors['bg_primary'])
+        grid.pack(fill=tk.BOTH, padx=15)
+
+        selection = {}
+        for n, language in enumerate(self.languages):
+            var = tk.BooleanVar(value=language in self.extra_targets)
+            selection[language] = var
+            ttk.Checkbutton(grid, text=language, variable=var,
+                            style="Discord.TCheckbutton").grid(
+                row=n // 2, column=n % 2, sticky=tk.W, padx=(0, 20), pady=2)
+
+        def on_ok():
+            self.extra_targets = [language for language in self.languages
+                                  if selection[language].get()]
+            self.extra_targets_label.config(text=self.describe_extra_targets())
+            dialog.destroy()
+
+        ttk.Button(dialog, text="✅ Valider", style="Discord.TButton",
+                   command=on_ok).pack(anchor=tk.E, padx=15, pady=15)
+
     def select_file(self):
         """Sélectionner un fichier ASS"""
         filetypes = [
@@ -557,69 +2130,191 @@ class AssTranslator:
             output_name = f"{path.stem}_{target_lang}{path.suffix}"
             self.output_file = path.parent / output_name
 
-    def parse_ass_file(self, filename: str) -> List[Dict]:
-        """Parser un fichier ASS et extraire les dialogues"""
-        dialogues = []
-
-        try:
-            with open(filename, 'r', encoding='utf-8-sig') as f:
-                content = f.read()
-        except UnicodeDecodeError:
-            with open(filename, 'r', encoding='latin-1') as f:
-                content = f.read()
+            if not self.series_var.get():
+                self.series_var.set(self.guess_series_name(path.stem))
+
+    def guess_series_name(self, stem: str) -> str:
+        """Deviner le nom de la série à partir du nom d'un épisode"""
+        name = re.sub(r'\[[^\]]*\]|\([^)]*\)', ' ', stem)
+        name = re.split(r'\s-\s*\d+|[\s._]S\d+E\d+|[\s._]E?\d{2,3}(?!\d)',
+                        name, maxsplit=1, flags=re.IGNORECASE)[0]
+        return re.sub(r'[\s._]+', ' ', name).strip()
+
+    def glossary_path(self, series: str) -> str:
+        """Chemin du glossaire d'une série, à côté de la configuration"""
+        safe_name = re.sub(r'[^\w\- ]+', '_', series).strip() or "défaut"
+        return os.path.join(self.glossary_dir, f"{safe_name}.txt")
+
+    def load_glossary(self, series: str) -> List[tuple]:
+        """Charger les paires (terme, traduction) du glossaire d'une série
+
+        Format : une entrée « terme = traduction » par ligne, # pour commenter.
+        """
+        path = self.glossary_path(series)
+        if not series or not os.path.exists(path):
+            return []
+
+        entries = {}
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#') or '=' not in line:
+                    continue
+                term, translation = line.split('=', 1)
+                if term.strip():
+                    entries[term.strip()] = translation.strip()
 
-        lines = content.split('\n')
-        in_events_section = False
-        format_line = None
+        # Ordre fixe : le préfixe du prompt reste identique octet pour octet
+        return sorted(entries.items())
 
-        for line in lines:
-            line = line.strip()
+    def edit_glossary(self):
+        """Ouvrir l'éditeur du glossaire de la série"""
+        series = self.series_var.get().strip()
+        if not series:
+            messagebox.showwarning("Attention",
+                                   "Veuillez indiquer le nom de la série")
+            return
 
-            if line == '[Events]':
-                in_events_section = True
+        path = self.glossary_path(series)
+        content = ""
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+        else:
+            content = ("# Glossaire de la série : terme = traduction\n"
+                       "# Exemple : Onii-chan = grand frère\n")
+
+        dialog = tk.Toplevel(self.root)
+        dialog.title(f"📖 Glossaire - {series}")
+        dialog.geometry("500x450")
+        dialog.configure(bg=self.colors['bg_primary'])
+        dialog.transient(self.root)
+
+        editor = tk.Text(dialog, wrap=tk.NONE,
+                         font=("Consolas", 10),
+                         bg=self.colors['bg_tertiary'],
+                         fg=self.colors['text_primary'],
+                         insertbackground=self.colors['text_primary'],
+                         selectbackground=self.colors['accent'],
+                         relief='flat', bd=0, padx=10, pady=10)
+        editor.pack(fill=tk.BOTH, expand=True, padx=15, pady=(15, 10))
+        editor.insert(1.0, content)
+
+        def on_save():
+            os.makedirs(self.glossary_dir, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(editor.get(1.0, tk.END).rstrip() + "\n")
+            dialog.destroy()
+
+        ttk.Button(dialog, text="💾 Sauvegarder",
+                   style="Discord.TButton",
+                   command=on_save).pack(anchor=tk.E, padx=15, pady=(0, 15))
+
+    def parse_ass_file(self, filename: str) -> AssEventStore:
+        """Parser un fichier ASS et extraire les dialogues
+
+        Le fichier est lu en flux par AssReader puis AssLexer : la mémoire
+        ne dépend que du nombre de dialogues, pas de la taille du fichier.
+        Les dialogues sont rangés dans un AssEventStore : chacun y a
+        l'action décidée par triage_event, son masquage TagMask (tiré des
+        balises relevées par AssLexer) et la position de sa ligne, dont se
+        sert write_translation. Les événements Comment: sont seulement
+        comptés (laissés tels quels).
+        """
+        self.comment_count = 0
+        self.subtitle_lines.close()
+
+        reader = AssReader(filename)
+        events = AssEventStore(filename)
+        for (start, end), kind, fields, values, text, spans in AssLexer().events_from(
+                reader.lines()):
+            if kind == 'Comment':
+                self.comment_count += 1
                 continue
-
-            if line.startswith('[') and line != '[Events]':
-                in_events_section = False
+            if values is None or not text:
                 continue
 
-            if in_events_section:
-                if line.startswith('Format:'):
-                    format_line = line[7:].strip()
-                    continue
-
-                if line.startswith('Dialogue:') and format_line:
-
-                    dialogue_data = line[9:].strip()
-                    fields = [f.strip() for f in format_line.split(',')]
-                    values = dialogue_data.split(',', len(fields) - 1)
-
-                    if len(values) >= len(fields):
-                        dialogue_dict = dict(zip(fields, values))
-                        if 'Text' in dialogue_dict:
-
-                            text = self.clean_ass_text(dialogue_dict['Text'])
-                            if text.strip():
-                                dialogues.append({
-                                    'original_line': line,
-                                    'text': text,
-                                    'start': dialogue_dict.get('Start', ''),
-                                    'end': dialogue_dict.get('End', ''),
-                                    'style': dialogue_dict.get('Style', ''),
-                                    'dialogue_dict': dialogue_dict
-                                })
-
-        return dialogues
+            style = values[fields.index('Style')] if 'Style' in fields else ''
+            raw_text = values[fields.index('Text')]
+            action = self.triage_event(style, raw_text, text)
+            masked = runs = None
+            if action == 'translate' and spans:
+                # Masqué dès maintenant : le champ Text n'est pas relu ensuite
+                masked, runs = TagMask.mask(raw_text, spans)
+            events.append(fields, start, end, style, action, text,
+                          masked, runs)
+
+        events.bom = reader.bom
+        events.fallback_start = reader.fallback_start
+        events.size, events.mtime = reader.size, reader.mtime
+        return events
+
+    def triage_event(self, style: str, raw: str, text: str) -> str:
+        """Classer un dialogue : translate, copy (gardé tel quel) ou skip
+
+        Dans l'ordre : dessins vectoriels, styles à ignorer puis à copier
+        (expressions régulières sur le nom du style), syllabes de karaoké,
+        lignes sans aucune lettre (minuteurs, numéros). raw est le champ
+        Text d'origine, text sa version nettoyée.
+        """
+        rules = self.triage_rules
+        style = style.strip()
+
+        if DRAWING_TAG_PATTERN.search(raw):
+            return rules['drawings']
+        if rules['skip_styles'] and re.search(rules['skip_styles'], style):
+            return 'skip'
+        if rules['copy_styles'] and re.search(rules['copy_styles'], style):
+            return 'copy'
+        if KARAOKE_TAG_PATTERN.search(raw):
+            return rules['karaoke']
+        if not any(char.isalpha() for char in text):
+            return rules['no_letters']
+        return 'translate'
+
+    def tag_languages(self):
+        """Identifier la langue de chaque dialogue à traduire (hors ligne)
+
+        La langue source peut avoir changé depuis l'analyse : l'étiquetage
+        est refait avant chaque traduction.
+        """
+        events = self.subtitle_lines
+        enabled = self.language_id_var.get()
+        source = self.source_lang.get()
+        events.languages = [
+            self.language_identifier.identify(text, source)
+            if enabled and action == 'translate' else ""
+            for text, action in zip(events.texts, events.actions)]
+
+    def line_languages(self) -> List[str]:
+        """Langues détectées des dialogues ("" si inconnue ou non détectée)"""
+        return self.subtitle_lines.languages
+
+    def describe_triage(self) -> str:
+        """Résumé du tri des événements pour l'aperçu"""
+        counts = Counter(self.subtitle_lines.actions)
+        text = (f"🗂️ Tri: {counts['translate']} à traduire, "
+                f"{counts['copy']} copiés tels quels, {counts['skip']} ignorés")
+        if self.comment_count:
+            text += f", {self.comment_count} commentaires laissés intacts"
+
+        source = self.source_lang.get()
+        target = self.target_lang.get()
+        in_target = other_script = 0
+        for language in self.line_languages():
+            if language == target and language != source:
+                in_target += 1
+            elif LanguageIdentifier.keep_as_is(language, source, target):
+                other_script += 1
+        if in_target or other_script:
+            text += (f"\n🔤 Langue: {in_target} lignes déjà en {target}, "
+                     f"{other_script} dans une autre écriture que la source "
+                     f"(gardées telles quelles)")
+        return text
 
     def clean_ass_text(self, text: str) -> str:
         """Nettoyer le texte ASS des balises de formatage"""
-
-        text = re.sub(r'\{[^}]*\}', '', text)
-
-        text = text.replace('\\N', ' ')
-
-        text = re.sub(r'\s+', ' ', text)
-        return text.strip()
+        return AssLexer.clean(text)[0]
 
     def analyze_file(self):
         """Analyser le fichier sélectionné"""
@@ -637,28 +2332,28 @@ class AssTranslator:
                 return
 
 
+            self.tag_languages()
+            source = self.source_lang.get()
+            target = self.target_lang.get()
+            events = self.subtitle_lines
+            marks = {'translate': '', 'copy': '⏩ ', 'skip': '⏭️ '}
             preview_lines = []
-            for i, line in enumerate(self.subtitle_lines):
-                text = line['text']
+            for i, (text, action, language) in enumerate(
+                    zip(events.texts, events.actions, events.languages)):
                 if len(text) > 120:
                     text = text[:120] + '...'
-                preview_lines.append(f"[{i+1:03d}] {text}")
+                mark = marks[action]
+                if LanguageIdentifier.keep_as_is(language, source, target):
+                    mark = '🔤 '
+                preview_lines.append(f"[{i+1:03d}] {mark}{text}")
 
             preview_text = "\n".join(preview_lines)
 
 
-            total_chars = sum(len(line['text']) 
-                             for line in self.subtitle_lines)
-            estimated_tokens = total_chars // 3
-            if self.model_choice.get() == "gpt-4":
-                cost_estimate = estimated_tokens * 0.00003
-            else:
-                cost_estimate = estimated_tokens * 0.000002
-
-            preview_text += (f"\n\n📊 Total: {len(self.subtitle_lines)} lignes "
-                             f"({estimated_tokens} tokens estimés)\n"
-                             f"💰 Coût estimé: ${cost_estimate:.4f} "
-                             f"avec {self.model_choice.get()}")
+            forecast = self.forecast(self.texts_to_translate(),
+                                     self.line_languages())
+            preview_text += ("\n\n" + self.describe_triage() + "\n" +
+                             self.describe_forecast(forecast))
 
             self.original_text.delete(1.0, tk.END)
             self.original_text.insert(1.0, preview_text)
@@ -670,99 +2365,1305 @@ class AssTranslator:
         except Exception as e:
             messagebox.showerror("Erreur", f"Erreur lors de l'analyse: {e}")
 
-    def get_translation_prompt(self, source_lang: str,
-                               target_lang: str) -> str:
-        """Créer le prompt professionnel pour ChatGPT"""
-        return f"""Traduis du {source_lang} vers le {target_lang}.
+    def texts_to_translate(self) -> List[str]:
+        """Textes envoyés à la traduction ("" pour les événements copiés/ignorés)
+
+        Avec la conservation des balises, c'est le texte masqué à la lecture
+        par TagMask qui part ; sinon le texte nettoyé. Le choix est gardé
+        dans le magasin d'événements pour l'écriture.
+        """
+        events = self.subtitle_lines
+        events.keep_tags = self.keep_tags_var.get()
+        return [events.sent_text(index) for index in range(len(events))]
+
+    def get_tokenizer(self, model: str):
+        """Tokenizer BPE local du modèle (tiktoken), None s'il est indisponible"""
+        if tiktoken is None:
+            return None
+        if model not in self.tokenizers:
+            try:
+                try:
+                    encoding = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    # Modèle inconnu de tiktoken : encodage de sa famille
+                    encoding = tiktoken.get_encoding(
+                        "o200k_base"
+                        if model.startswith(("gpt-4o", "o1", "o3"))
+                        else "cl100k_base")
+            except Exception as e:
+                # Fichiers BPE non téléchargeables (hors ligne...)
+                print(f"Tokenizer indisponible pour {model}: {e}")
+                encoding = None
+            self.tokenizers[model] = encoding
+        return self.tokenizers[model]
+
+    def count_tokens(self, text: str, model: str) -> int:
+        """Compter les tokens d'un texte avec le tokenizer du modèle"""
+        encoding = self.get_tokenizer(model)
+        if encoding is None:
+            return self.estimate_tokens(text)
+        return len(encoding.encode(text))
+
+    def forecast(self, texts: List[str], languages: List[str] = None) -> Dict:
+        """Prévoir requêtes, tokens, coût et durée d'une traduction
+
+        Reprend le découpage de translate_batch (filtre, dédoublonnage,
+        lots fixes ou remplis par tokens), compte l'entrée avec le
+        tokenizer du modèle et la sortie avec le rapport appris (médiane),
+        puis applique les limites requêtes/tokens par minute et le nombre
+        de requêtes simultanées. Les lignes gardées telles quelles pour
+        toutes les langues cibles (voir languages) ne comptent pas. La
+        mémoire de traduction n'est pas consultée : le coût prévu est un
+        maximum.
+        """
+        model = self.model_choice.get()
+        json_mode = self.json_mode_var.get()
+        targets = self.get_targets()
+        run = {
+            'source': self.source_lang.get(),
+            'prompt': self.build_prompt(json_mode, targets),
+            'model': model,
+            'targets': targets,
+            'token_packing': self.token_packing_var.get(),
+            'json_mode': json_mode
+        }
+
+        pending = [i for i, text in enumerate(texts)
+                   if text.strip() and len(text.strip()) > 2]
+        if languages:
+            pending = [i for i in pending if not all(
+                LanguageIdentifier.keep_as_is(languages[i], run['source'], target)
+                for target in targets)]
+        unique = {}
+        for i in pending:
+            unique.setdefault(texts[i], i)
+        pending = list(unique.values())
+
+        ratio = self.token_ratios.ratio(self.ratio_key(run), 0.5)
+        if run['token_packing']:
+            batches = self.pack_batches(
+                pending, texts,
+                self.token_ratios.ratio(self.ratio_key(run),
+                                        self.max_tokens_percentile))
+        else:
+            batch_size = self.batch_size_var.get()
+            batches = [pending[n:n + batch_size]
+                       for n in range(0, len(pending), batch_size)]
+
+        # ~3 tokens d'enveloppe par message, plus l'amorce de la réponse
+        prompt_tokens = self.count_tokens(run['prompt'], model) + 9
+        input_tokens = output_tokens = reserved_tokens = 0
+        speed = MODEL_OUTPUT_SPEEDS.get(model, 50)
+        busy_seconds = longest = 0.0
+        for batch in batches:
+            batch_texts = [texts[i] for i in batch]
+            content = self.format_batch(batch_texts, json_mode)
+            if ratio is not None:
+                expected = int(ratio * self.estimate_tokens(content))
+            else:
+                expected = int(self.count_tokens(content, model) * 1.1 *
+                               len(targets))
+            input_tokens += prompt_tokens + self.count_tokens(content, model)
+            output_tokens += expected
+            reserved_tokens += (self.estimate_tokens(run['prompt']) +
+                                self.estimate_tokens(content) +
+                                self.batch_max_tokens(batch_texts, run))
+            latency = 0.8 + expected / speed
+            busy_seconds += latency
+            longest = max(longest, latency)
+
+        # Chaque endpoint du pool apporte ses propres limites
+        endpoint_count = max(1, (1 if self.api_key.get() else 0) +
+                             len(self.endpoints))
+        rate_seconds = 60.0 * max(
+            len(batches) / (self.rpm_limit * endpoint_count),
+            reserved_tokens / (self.tpm_limit * endpoint_count))
+        workers = max(1, self.concurrency_var.get())
+        duration = max(rate_seconds, busy_seconds / workers, longest)
+
+        cost = None
+        cascade_model = self.get_cascade_model()
+        if model in MODEL_PRICES and (not cascade_model or
+                                      cascade_model in MODEL_PRICES):
+            def price(name, share=1.0):
+                input_price, output_price = MODEL_PRICES[name]
+                return share * (input_tokens * input_price +
+                                output_tokens * output_price) / 1e6
+
+            if cascade_model:
+                # Part escaladée : celle de la dernière cascade, sinon 15 %
+                stats = self.cascade_stats
+                share = (stats['escalated'] / stats['lines']
+                         if stats['lines'] else 0.15)
+                cost = price(cascade_model) + price(model, share)
+            else:
+                cost = price(model)
+            if self.batch_job_var.get():
+                cost *= 0.5
+
+        encoding = self.get_tokenizer(model)
+        return {
+            'lines': len(texts),
+            'unique': len(pending),
+            'requests': len(batches),
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'learned_ratio': ratio is not None,
+            'tokenizer': encoding.name if encoding else None,
+            'cost': cost,
+            'duration': duration,
+            'rate_limited': rate_seconds >= busy_seconds / workers,
+            'model': model
+        }
+
+    def describe_forecast(self, forecast: Dict) -> str:
+        """Mettre en forme la prévision pour l'aperçu"""
+        tokenizer = (f"tokenizer {forecast['tokenizer']}" if forecast['tokenizer']
+                     else "estimation sans tiktoken")
+        output = ("rapport appris" if forecast['learned_ratio']
+                  else "estimation")
+        lines = [
+            f"📊 Total: {forecast['lines']} lignes "
+            f"({forecast['unique']} textes distincts à traduire)",
+            f"🔢 Tokens: {forecast['input_tokens']} en entrée ({tokenizer}), "
+            f"~{forecast['output_tokens']} en sortie ({output})",
+            f"📨 Requêtes: {forecast['requests']} lots"
+        ]
+
+        if forecast['cost'] is None:
+            lines.append(f"💰 Coût estimé: tarif inconnu pour {forecast['model']}")
+        else:
+            lines.append(f"💰 Coût estimé: ${forecast['cost']:.4f} avec "
+                         f"{forecast['model']} (hors mémoire de traduction)")
+
+        if self.batch_job_var.get():
+            lines.append("⏱️ Durée estimée: jusqu'à 24 h (job Batch API)")
+        else:
+            limit = (" — limitée par les quotas rpm/tpm"
+                     if forecast['rate_limited'] else "")
+            lines.append(f"⏱️ Durée estimée: ~{format_duration(forecast['duration'])}"
+                         f"{limit}")
+        return "\n".join(lines)
+
+    def get_translation_prompt(self, source_lang: str, target_lang: str,
+                               json_mode: bool = False,
+                               glossary: List[tuple] = None,
+                               targets: List[str] = None,
+                               placeholders: bool = False) -> str:
+        """Créer le prompt professionnel pour ChatGPT
+
+        Le prompt ne dépend que des réglages et du glossaire : il forme un
+        préfixe identique pour tous les lots, que l'API peut mettre en cache.
+        Avec plusieurs langues cibles, chaque ligne N est traduite dans
+        chaque langue L et identifiée par "N.L". placeholders ajoute la
+        règle des marqueurs de balises ({1}, {2}... voir TagMask).
+        """
+        glossary_text = ""
+        if glossary:
+            terms = "\n".join(f"- {term} → {translation}"
+                              for term, translation in glossary)
+            glossary_text = f"\nGLOSSAIRE (traductions imposées):\n{terms}\n"
+
+        placeholder_rule = ""
+        if placeholders:
+            placeholder_rule = ("\n- Recopie les marqueurs {1}, {2}... tels "
+                                "quels, à l'endroit correspondant de la phrase")
+
+        if targets and len(targets) > 1:
+            languages = ", ".join(f"{k + 1}={target}"
+                                  for k, target in enumerate(targets))
+            header = f"Traduis du {source_lang} vers: {languages}."
+            if json_mode:
+                answer = ('Réponds en JSON: {"translations": '
+                          '[{"id": "<N>.<L>", "text": "<traduction>"}]}, '
+                          'un élément par ligne N et par langue L.')
+            else:
+                answer = ("Pour chaque ligne N, réponds une ligne par langue L "
+                          "au format « N.L. traduction ».")
+        else:
+            header = f"Traduis du {source_lang} vers le {target_lang}."
+            if json_mode:
+                answer = ('Réponds en JSON: {"translations": '
+                          '[{"id": <id>, "text": "<traduction>"}]}, '
+                          'un élément par id reçu.')
+            else:
+                answer = "Réponds seulement les traductions numérotées."
+
+        return f"""{header}
 
 RÈGLES:
 - Garde l'anglais approprié (noms, marques, expressions)
 - Style naturel, pas robotique
 - Adapte le registre au contexte
-- Conserve le ton émotionnel
-
-Réponds seulement les traductions numérotées."""
-
-    def translate_batch(self, texts: List[str]) -> List[str]:
-        """Traduire un lot de textes via ChatGPT"""
-        if not self.api_key.get():
+- Conserve le ton émotionnel{placeholder_rule}
+{glossary_text}
+{answer}"""
+
+    def build_prompt(self, json_mode: bool = False,
+                     targets: List[str] = None) -> str:
+        """Construire le prompt système de la traduction en cours"""
+        glossary = self.load_glossary(self.series_var.get().strip())
+        targets = targets or [self.target_lang.get()]
+        return self.get_translation_prompt(self.source_lang.get(),
+                                           targets[0], json_mode, glossary,
+                                           targets, self.keep_tags_var.get())
+
+    def get_cascade_model(self) -> str:
+        """Modèle économique de la cascade, "" si la cascade est inactive"""
+        if (self.cascade_var.get() and self.cascade_model and
+                self.cascade_model != self.model_choice.get()):
+            return self.cascade_model
+        return ""
+
+    def get_targets(self) -> List[str]:
+        """Langue cible principale suivie des langues supplémentaires"""
+        targets = [self.target_lang.get()]
+        for target in self.extra_targets:
+            if target not in targets and target != self.source_lang.get():
+                targets.append(target)
+        return targets
+
+    def record_usage(self, usage):
+        """Cumuler les tokens consommés, dont ceux servis par le cache de prompt"""
+        if usage is None:
+            return
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached = getattr(details, 'cached_tokens', 0) or 0
+        with self.usage_lock:
+            self.usage_stats['prompt'] += usage.prompt_tokens or 0
+            self.usage_stats['completion'] += usage.completion_tokens or 0
+            self.usage_stats['cached'] += cached
+
+    def build_endpoint_pool(self) -> EndpointPool:
+        """Construire le pool : clé principale puis endpoints de [ENDPOINTS]"""
+        endpoints = []
+        if self.api_key.get():
+            endpoints.append(Endpoint("principal", self.base_url,
+                                      self.api_key.get(), "", 1,
+                                      self.rpm_limit, self.tpm_limit))
+        for e in self.endpoints:
+            endpoints.append(Endpoint(e['name'], e['base_url'], e['key'],
+                                      e['model'], e['weight'],
+                                      self.rpm_limit, self.tpm_limit))
+        if not endpoints:
             raise ValueError("Clé API OpenAI manquante")
+        return EndpointPool(endpoints, self.endpoint_strategy)
+
+    def call_api(self, pool: EndpointPool, token_count: int,
+                 cancel: threading.Event = None, **params):
+        """Appeler l'API en respectant les limites, avec reprise sur 429/5xx
+
+        Chaque tentative est confiée à un endpoint du pool (une reprise peut
+        donc partir ailleurs). Retourne (réponse, endpoint) : l'appelant rend
+        l'endpoint avec pool.release une fois la réponse lue, ce qui compte
+        un flux comme requête en cours jusqu'à sa fin. Si cancel est levé
+        avant l'envoi d'une tentative, RequestCancelled est levée sans
+        envoyer (ni payer) la requête.
+        """
+        for attempt in range(self.max_retries + 1):
+            if cancel and cancel.is_set():
+                raise RequestCancelled()
+            endpoint = pool.acquire(params['model'])
+            limiter = endpoint.limiter
+            limiter.acquire(token_count)
+            if cancel and cancel.is_set():
+                # Doublon servi pendant l'attente des limites
+                pool.release(endpoint)
+                raise RequestCancelled()
+            try:
+                raw = endpoint.client.chat.completions.with_raw_response.create(
+                    **params)
+                limiter.update_from_headers(raw.headers)
+                return raw.parse(), endpoint
+
+            except (openai.AuthenticationError, openai.PermissionDeniedError,
+                    openai.NotFoundError):
+                # Clé ou modèle refusé : inutile d'insister sur cet endpoint
+                pool.release(endpoint, ok=False, fatal=True)
+                if (attempt == self.max_retries or
+                        not pool.has_alternative(endpoint, params['model'])):
+                    raise
+
+            except openai.RateLimitError as e:
+                if getattr(e, 'code', None) == 'insufficient_quota':
+                    # Quota épuisé : attendre ne le rechargera pas
+                    pool.release(endpoint, ok=False, fatal=True)
+                    if (attempt == self.max_retries or
+                            not pool.has_alternative(endpoint,
+                                                     params['model'])):
+                        raise
+                    continue
 
-        client = openai.OpenAI(api_key=self.api_key.get())
-        translations = []
-        batch_size = self.batch_size_var.get()
-
-
-        filtered_texts = []
-        text_indices = []
-        for i, text in enumerate(texts):
-            if text.strip() and len(text.strip()) > 2:
-                filtered_texts.append(text)
-                text_indices.append(i)
-
-
-        for i in range(0, len(filtered_texts), batch_size):
-            batch = filtered_texts[i:i + batch_size]
-
-
+                # Endpoint saturé mais en bonne santé : seul son budget attend
+                pool.release(endpoint)
+                if attempt == self.max_retries:
+                    raise
+                limiter.update_from_headers(e.response.headers)
+                limiter.pause(random.uniform(0, min(60, 2 ** attempt)))
+
+            except (openai.InternalServerError, openai.APIConnectionError) as e:
+                pool.release(endpoint, ok=False)
+                if attempt == self.max_retries:
+                    raise
+                response = getattr(e, 'response', None)
+                headers = response.headers if response is not None else None
+                limiter.update_from_headers(headers)
+
+                # Backoff exponentiel avec jitter complet
+                backoff = random.uniform(0, min(60, 2 ** attempt))
+                limiter.pause(backoff)
+
+            except Exception:
+                # Requête invalide : l'endpoint n'y est pour rien
+                pool.release(endpoint)
+                raise
+
+    def estimate_tokens(self, text: str) -> int:
+        """Estimer le nombre de tokens d'un texte sans tokenizer
+
+        ~4 caractères ASCII par token, ~2 pour le latin accentué,
+        ~1 pour les autres écritures (CJK, cyrillique, arabe...).
+        """
+        weight = 0.0
+        for char in text:
+            code = ord(char)
+            if code < 0x80:
+                weight += 0.25
+            elif code < 0x250:
+                weight += 0.5
+            else:
+                weight += 1.0
+        return int(weight) + 1
+
+    def estimate_output_tokens(self, text: str) -> int:
+        """Estimer les tokens de sortie d'une ligne numérotée traduite"""
+        return int(self.estimate_tokens(text) * 1.5) + 3
+
+    def pack_batches(self, indices: List[int], texts: List[str],
+                     output_ratio: float = None) -> List[List[int]]:
+        """Remplir chaque lot jusqu'aux budgets de tokens d'entrée et de sortie
+
+        output_ratio (rapport appris sortie/entrée) remplace l'estimation
+        fixe de la sortie quand il est connu.
+        """
+        batches = []
+        current = []
+        input_total = output_total = 0
+
+        for i in indices:
+            input_tokens = self.estimate_tokens(texts[i]) + 3
+            if output_ratio is not None:
+                output_tokens = int(output_ratio * input_tokens) + 1
+            else:
+                output_tokens = self.estimate_output_tokens(texts[i])
+
+            if current and (input_total + input_tokens > self.batch_input_tokens or
+                            output_total + output_tokens > self.batch_output_tokens):
+                batches.append(current)
+                current = []
+                input_total = output_total = 0
+
+            current.append(i)
+            input_total += input_tokens
+            output_total += output_tokens
+
+        if current:
+            batches.append(current)
+        return batches
+
+    def batch_max_tokens(self, batch: List[str], run: Dict) -> int:
+        """Calculer max_tokens pour un lot (toutes langues cibles comprises)
+
+        Dès que le rapport sortie/entrée de la combinaison langues + modèle
+        est connu, max_tokens suit son percentile élevé (avec 10 % de marge) ;
+        sinon les estimations fixes ci-dessous servent de départ. Le résultat
+        ne dépasse jamais la limite de sortie du modèle.
+        """
+        target_count = len(run['targets'])
+        limit = MODEL_OUTPUT_LIMITS.get(run['model'], DEFAULT_OUTPUT_LIMIT)
+        ratio = self.token_ratios.ratio(self.ratio_key(run),
+                                        self.max_tokens_percentile)
+        if ratio is not None:
+            input_tokens = self.estimate_tokens(
+                self.format_batch(batch, run['json_mode']))
+            return max(32, min(limit, int(ratio * input_tokens * 1.1) + 16))
+
+        if not run['token_packing']:
             numbered_texts = "\n".join([f"{j+1}. {text}"
                                         for j, text in enumerate(batch)])
-
-            prompt = self.get_translation_prompt(self.source_lang.get(),
-                                                 self.target_lang.get())
-
+            return min(min(len(numbered_texts) * 2, 1500) * target_count,
+                       limit)
+
+        # Marge de 25 % sur la sortie estimée, bornée par le budget de sortie
+        # (sauf ligne isolée plus longue que le budget à elle seule)
+        overhead = 10 if run['json_mode'] else 0
+        expected = sum(self.estimate_output_tokens(text) + overhead
+                       for text in batch) * target_count
+        return min(max(self.batch_output_tokens, expected),
+                   int(expected * 1.25) + 16, limit)
+
+    def ratio_key(self, run: Dict) -> str:
+        """Clé des rapports de tokens pour les langues et le modèle d'un lot"""
+        return TokenRatioStats.make_key(run['source'], run['targets'],
+                                        run['model'], run['json_mode'])
+
+    def observe_ratio(self, batch: List[str], run: Dict, usage,
+                      truncated: bool = False):
+        """Apprendre le rapport sortie/entrée d'un lot terminé"""
+        if usage is None:
+            return
+        input_tokens = self.estimate_tokens(
+            self.format_batch(batch, run['json_mode']))
+        self.token_ratios.observe(self.ratio_key(run), input_tokens,
+                                  usage.completion_tokens or 0, truncated)
+
+    def format_batch(self, batch: List[str], json_mode: bool) -> str:
+        """Mettre en forme le contenu utilisateur d'un lot (numéroté ou JSON)"""
+        if json_mode:
+            lines = [{"id": j + 1, "text": text} for j, text in enumerate(batch)]
+            return json.dumps({"lines": lines}, ensure_ascii=False)
+        return "\n".join([f"{j+1}. {text}" for j, text in enumerate(batch)])
+
+    def build_request_params(self, batch: List[str], run: Dict,
+                             max_tokens: int) -> Dict:
+        """Paramètres de chat.completions.create pour un lot"""
+        params = {
+            'model': run['model'],
+            'messages': [
+                {"role": "system", "content": run['prompt']},
+                {"role": "user",
+                 "content": self.format_batch(batch, run['json_mode'])}
+            ],
+            'temperature': 0.1,
+            'max_tokens': max_tokens
+        }
+        if run['json_mode']:
+            params['response_format'] = {"type": "json_object"}
+        return params
+
+    def request_batch(self, pool: EndpointPool, batch: List[str],
+                      run: Dict, max_tokens: int, on_line=None,
+                      cancel: threading.Event = None) -> Dict[int, str]:
+        """Envoyer un lot à ChatGPT et extraire les traductions
+
+        Retourne les traductions par position dans le lot ; les positions
+        absentes ou ambiguës de la réponse sont omises. Si cancel est levé
+        (doublon déjà servi), la réponse est abandonnée.
+        """
+        params = self.build_request_params(batch, run, max_tokens)
+        user_content = params['messages'][-1]['content']
+
+        token_count = (self.estimate_tokens(run['prompt']) +
+                       self.estimate_tokens(user_content) + max_tokens)
+
+        if run['stream']:
+            received = self.stream_batch(pool, batch, token_count,
+                                         params, run, on_line, cancel)
+        else:
+            response, endpoint = self.call_api(pool, token_count, cancel,
+                                               **params)
+            pool.release(endpoint)
+            self.record_usage(response.usage)
+            self.observe_ratio(batch, run, response.usage,
+                               response.choices[0].finish_reason == 'length')
+            if cancel and cancel.is_set():
+                raise RequestCancelled()
+            result = response.choices[0].message.content.strip()
+            received = self.parse_result(result, batch, run)
+
+            if on_line:
+                for j, translation in received.items():
+                    on_line(j, translation)
+
+        if not received:
+            raise ValueError("Aucune ligne exploitable dans la réponse")
+
+        return received
+
+    def estimate_request_tokens(self, batch: List[str], run: Dict) -> int:
+        """Estimer les tokens consommés par un lot (prompt, lignes, réponse)"""
+        output = sum(self.estimate_output_tokens(text) for text in batch)
+        return (self.estimate_tokens(run['prompt']) +
+                self.estimate_tokens(self.format_batch(batch, run['json_mode'])) +
+                output * len(run['targets']))
+
+    def hedged_request(self, pool: EndpointPool, batch: List[str], run: Dict,
+                       max_tokens: int, on_line=None) -> Dict[int, str]:
+        """Envoyer un lot, doublé d'une requête de secours s'il traîne
+
+        Passé le seuil de latence du hedger, un doublon part (le pool le
+        confie de préférence à un autre endpoint, éventuellement avec le
+        modèle de secours) ; la première réponse valide l'emporte et
+        l'autre est annulée (sans être envoyée si elle attend encore les
+        limites). Seules les requêtes menées à terme nourrissent la latence.
+        """
+        hedger = run['hedger']
+        emitted = set()
+        emitted_lock = threading.Lock()
+        cancels = []
+
+        def emit(p, text):
+            # Chaque ligne n'est affichée qu'une fois, quelle que soit la requête
+            with emitted_lock:
+                if p in emitted:
+                    return
+                emitted.add(p)
+            if on_line:
+                on_line(p, text)
+
+        def submit(model=None, started=None):
+            cancel = threading.Event()
+            cancels.append(cancel)
+            attempt_run = dict(run, model=model) if model else run
+
+            def attempt():
+                # L'attente d'un thread libre n'est pas de la latence
+                if started:
+                    started.set()
+                begin = time.monotonic()
+                received = self.request_batch(pool, batch, attempt_run,
+                                              max_tokens, emit, cancel)
+                if not cancel.is_set():
+                    hedger.record(time.monotonic() - begin, len(batch))
+                return received
+            return hedger.executor.submit(attempt)
+
+        primary_started = threading.Event()
+        primary = submit(started=primary_started)
+        pending = {primary}
+        delay = hedger.threshold(len(batch))
+        if delay is not None:
+            primary_started.wait()
             try:
-                response = client.chat.completions.create(
-                    model=self.model_choice.get(),
-                    messages=[
-                        {"role": "system", "content": prompt},
-                        {"role": "user", "content": numbered_texts}
-                    ],
-                    temperature=0.1,
-                    max_tokens=min(len(numbered_texts) * 2, 1500)
-                )
+                return primary.result(timeout=delay)
+            except FutureTimeoutError:
+                if hedger.reserve(self.estimate_request_tokens(batch, run)):
+                    pending.add(submit(hedger.model))
+
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    received = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                for cancel in cancels:
+                    cancel.set()
+                if future is not primary:
+                    hedger.record_win()
+                return received
+        raise error
+
+    def send_batch(self, pool: EndpointPool, batch: List[str], run: Dict,
+                   on_line=None) -> Dict[int, str]:
+        """Envoyer un lot en une requête (doublée si le hedging est actif)"""
+        max_tokens = self.batch_max_tokens(batch, run)
+        if run.get('hedger'):
+            return self.hedged_request(pool, batch, run, max_tokens, on_line)
+        return self.request_batch(pool, batch, run, max_tokens, on_line)
+
+    def check_translation(self, source: str, translation: str,
+                          target: str) -> str:
+        """Contrôler une ligne traduite : raison de l'échec, ou "" si valide"""
+        return self.validator.check_line(source, translation, target)
+
+    def cascade_lines(self, pool: EndpointPool, batch: List[str], run: Dict,
+                      on_line=None) -> Dict[int, str]:
+        """Traduire un lot avec le modèle économique, puis escalader les échecs
+
+        Le lot part une seule fois vers run['cascade_model'] ; les lignes
+        absentes ou rejetées par check_translation sont renvoyées au modèle
+        principal (avec réparation et découpage habituels). À défaut de
+        meilleure réponse, la traduction économique est conservée.
+        """
+        target_count = len(run['targets'])
+        cheap_run = dict(run, model=run['cascade_model'])
+
+        def checked(p, text):
+            # Seules les lignes validées sont affichées avant l'escalade
+            if on_line and not self.check_translation(
+                    batch[p // target_count], text,
+                    run['targets'][p % target_count]):
+                on_line(p, text)
 
+        try:
+            received = self.send_batch(pool, batch, cheap_run, checked)
+        except (openai.AuthenticationError, openai.PermissionDeniedError,
+                openai.NotFoundError):
+            raise
+        except Exception as e:
+            print(f"Modèle économique en échec sur un lot: {e}")
+            received = {}
 
-                result = response.choices[0].message.content.strip()
+        escalate = sorted({p // target_count
+                           for p in range(len(batch) * target_count)
+                           if p not in received or
+                           self.check_translation(batch[p // target_count],
+                                                  received[p],
+                                                  run['targets'][p % target_count])})
 
+        with self.usage_lock:
+            self.cascade_stats['lines'] += len(batch)
+            self.cascade_stats['escalated'] += len(escalate)
 
-                batch_translations = []
-                for line in result.split('\n'):
-                    if re.match(r'^\d+\.', line):
+        if escalate:
+            def remap(p, text):
+                j, k = divmod(p, target_count)
+                on_line(escalate[j] * target_count + k, text)
 
-                        translation = re.sub(r'^\d+\.\s*', '', line).strip()
-                        batch_translations.append(translation)
+            try:
+                part = self.translate_lines(pool,
+                                            [batch[j] for j in escalate],
+                                            run, remap if on_line else None)
+            except TRANSPORT_ERRORS as e:
+                if not received:
+                    raise
+                # Garder les traductions économiques plutôt que tout perdre
+                print(f"Escalade impossible ({len(escalate)} lignes): {e}")
+                part = {}
+            for p, text in part.items():
+                j, k = divmod(p, target_count)
+                received[escalate[j] * target_count + k] = text
+
+        return received
+
+    def translate_lines(self, pool: EndpointPool, batch: List[str],
+                        run: Dict, on_line=None) -> Dict[int, str]:
+        """Traduire un lot en ne redemandant que les lignes manquantes
+
+        Les lignes absentes d'une réponse sont renvoyées seules ; un lot dont
+        la réponse est inexploitable (vide, illisible, requête refusée en
+        400) est coupé en deux jusqu'à isoler la ligne fautive. Les erreurs
+        de transport, déjà reprises par call_api, et les TypeError (SDK
+        incompatible) remontent telles quelles si l'envoi du lot lui-même
+        échoue ; si c'est une relance ou une moitié, les lignes déjà reçues
+        sont gardées et les autres restent manquantes.
+        Retourne les traductions obtenues par position (ligne × nombre de
+        langues cibles + langue).
+        """
+        target_count = len(run['targets'])
+
+        def position(lines, p):
+            return lines[p // target_count] * target_count + p % target_count
+
+        def remap(lines):
+            if not on_line:
+                return None
+            return lambda p, text: on_line(position(lines, p), text)
+
+        def translate_part(lines):
+            try:
+                part = self.translate_lines(pool,
+                                            [batch[j] for j in lines],
+                                            run, remap(lines))
+            except TRANSPORT_ERRORS as e:
+                # Le reste du lot est déjà payé : ne pas le perdre
+                print(f"{len(lines)} ligne(s) laissée(s) sans traduction: {e}")
+                return {}
+            return {position(lines, p): text for p, text in part.items()}
 
+        try:
+            received = self.send_batch(pool, batch, run, on_line)
 
-                if len(batch_translations) != len(batch):
+        except (openai.AuthenticationError, openai.PermissionDeniedError,
+                openai.NotFoundError):
+            # Erreur de configuration : découper le lot n'y changerait rien
+            raise
 
-                    lines = [line.strip() for line in result.split('\n')
-                             if line.strip()]
-                    batch_translations = lines[:len(batch)]
-                    if len(batch_translations) < len(batch):
-                        missing_count = len(batch) - len(batch_translations)
-                        batch_translations.extend(batch[-missing_count:])
+        except TypeError:
+            # SDK openai trop ancien (stream_options...) : erreur de programme
+            raise
 
-                translations.extend(batch_translations)
+        except TRANSPORT_ERRORS:
+            # Déjà reprise par call_api : découper multiplierait les appels
+            raise
 
+        except Exception as e:
+            if len(batch) == 1:
+                print(f"Ligne impossible à traduire ({batch[0][:40]}): {e}")
+                return {}
+            half = len(batch) // 2
+            received = translate_part(list(range(half)))
+            received.update(translate_part(list(range(half, len(batch)))))
+            return received
+
+        missing = sorted({p // target_count
+                          for p in range(len(batch) * target_count)
+                          if p not in received})
+        if missing:
+            for p, text in translate_part(missing).items():
+                received.setdefault(p, text)
+
+        return received
+
+    def item_position(self, item_id: str, batch_length: int,
+                      target_count: int) -> int:
+        """Convertir un id de réponse ("N" ou "N.L") en position, -1 si invalide"""
+        line, _, language = item_id.partition('.')
+        if (target_count > 1) != bool(language):
+            return -1
+
+        j = int(line) - 1
+        k = int(language) - 1 if language else 0
+        if not (0 <= j < batch_length and 0 <= k < target_count):
+            return -1
+        return j * target_count + k
+
+    def parse_result(self, result: str, batch: List[str],
+                     run: Dict) -> Dict[int, str]:
+        """Associer chaque élément de la réponse à sa position d'origine
+
+        Les ids hors lot, les traductions vides et les ids répétés avec des
+        textes différents sont ignorés (redemandés ensuite).
+        """
+        json_mode = run['json_mode']
+        target_count = len(run['targets'])
+        if json_mode:
+            items = self.parse_json_items(result)
+        else:
+            items = []
+            for line in result.split('\n'):
+                match = NUMBERED_LINE_PATTERN.match(line)
+                if match:
+                    items.append((match.group(1), match.group(2)))
+
+        received = {}
+        ambiguous = set()
+        for item_id, translation in items:
+            p = self.item_position(item_id, len(batch), target_count)
+            translation = translation.strip()
+            if p < 0 or not translation:
+                continue
+            if p in received and received[p] != translation:
+                ambiguous.add(p)
+            received[p] = translation
 
-                is_gpt35 = self.model_choice.get() == "gpt-3.5-turbo"
-                delay = 0.5 if is_gpt35 else 1
-                time.sleep(delay)
+        for p in ambiguous:
+            del received[p]
 
-            except Exception as e:
+        if (not received and len(batch) == 1 and target_count == 1 and
+                result and not json_mode):
+            # Une ligne seule peut revenir sans numéro
+            received[0] = result
 
-                translations.extend(batch)
-                print(f"Erreur de traduction pour le lot "
-                      f"{i//batch_size + 1}: {e}")
+        return received
 
+    def parse_json_items(self, result: str) -> List[tuple]:
+        """Extraire les paires (id, texte) d'une réponse JSON
 
-        final_translations = texts.copy()
-        for i, filtered_index in enumerate(text_indices):
-            if i < len(translations):
-                final_translations[filtered_index] = translations[i]
+        Une réponse tronquée n'est pas du JSON valide : on récupère alors
+        les éléments complets un par un.
+        """
+        try:
+            data = json.loads(result)
+        except ValueError:
+            return [(match.group(1), json.loads(match.group(2)))
+                    for match in JSON_ITEM_PATTERN.finditer(result)]
+
+        if isinstance(data, dict):
+            data = data.get('translations', [])
+        items = []
+        for item in data if isinstance(data, list) else []:
+            if not isinstance(item, dict) or not isinstance(item.get('text'), str):
+                continue
+            item_id = str(item.get('id', ''))
+            if re.fullmatch(r'\d+(?:\.\d+)?', item_id):
+                items.append((item_id, item['text']))
+        return items
+
+    def stream_batch(self, pool: EndpointPool, batch: List[str],
+                     token_count: int, params: Dict, run: Dict,
+                     on_line=None, cancel: threading.Event = None) -> Dict[int, str]:
+        """Recevoir une réponse en flux et valider chaque ligne dès qu'elle est complète
+
+        Retourne les traductions reçues par position dans le lot. Si le flux
+        est interrompu, les lignes déjà complètes sont conservées.
+        """
+        json_mode = run['json_mode']
+        target_count = len(run['targets'])
+        received = {}
+
+        def commit(item_id, translation):
+            p = self.item_position(item_id, len(batch), target_count)
+            translation = translation.strip()
+            if p >= 0 and translation and p not in received:
+                received[p] = translation
+                if on_line:
+                    on_line(p, translation)
+
+        content = ''
+        scanned = 0
+        endpoint = None
+        truncated = False
+        try:
+            response, endpoint = self.call_api(pool, token_count, cancel,
+                                               stream=True,
+                                               stream_options={"include_usage": True},
+                                               **params)
+            for chunk in response:
+                if cancel and cancel.is_set():
+                    response.close()
+                    raise RequestCancelled()
+                # Le dernier fragment ne porte que la consommation du lot
+                usage = getattr(chunk, 'usage', None)
+                if usage:
+                    self.record_usage(usage)
+                    self.observe_ratio(batch, run, usage, truncated)
+                if not chunk.choices:
+                    continue
+                content += chunk.choices[0].delta.content or ''
+                if getattr(chunk.choices[0], 'finish_reason', None) == 'length':
+                    truncated = True
+
+                if json_mode:
+                    # Chaque élément {"id": .., "text": ..} est autonome
+                    for match in JSON_ITEM_PATTERN.finditer(content, scanned):
+                        commit(match.group(1), json.loads(match.group(2)))
+                        scanned = match.end()
+                else:
+                    end = content.rfind('\n')
+                    for line in content[scanned:max(end, scanned)].split('\n'):
+                        match = NUMBERED_LINE_PATTERN.match(line)
+                        if match:
+                            commit(match.group(1), match.group(2))
+                    scanned = max(end + 1, scanned)
+
+            if not json_mode:
+                match = NUMBERED_LINE_PATTERN.match(content[scanned:])
+                if match:
+                    commit(match.group(1), match.group(2))
+            pool.release(endpoint)
+
+        except RequestCancelled:
+            if endpoint:
+                pool.release(endpoint)
+            raise
 
-        return final_translations
+        except Exception as e:
+            if endpoint:
+                # Flux coupé en cours de route : compte comme un échec de l'endpoint
+                pool.release(endpoint, ok=False)
+            if not received:
+                raise
+            print(f"Flux interrompu après {len(received)} lignes: {e}")
+            return received
+
+        if not received:
+            # Réponse complète mais non reconnue : même analyse que sans flux
+            received = self.parse_result(content.strip(), batch, run)
+            if on_line:
+                for j, translation in received.items():
+                    on_line(j, translation)
+
+        return received
+
+    def run_batch_job(self, pool: EndpointPool, texts: List[str],
+                      batches: List[List[int]], run: Dict,
+                      state_path: str = None) -> Dict[int, tuple]:
+        """Traduire tous les lots via la Batch API (traitement différé)
+
+        Les lots sont envoyés dans un seul fichier JSONL, puis l'état du job
+        est interrogé jusqu'à sa fin. L'identifiant du job et la composition
+        des lots sont enregistrés dans state_path : une nouvelle exécution
+        reprend le suivi du même job au lieu de le soumettre à nouveau.
+        Retourne {numéro de lot: (index des lignes, traductions par position)}.
+        """
+        # Les fichiers et le job restent sur le premier endpoint du modèle
+        client = pool.serving(run['model'])[0].client
+        state = None
+        if state_path and os.path.exists(state_path):
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+
+        if state is None:
+            lines = []
+            for n, batch in enumerate(batches):
+                batch_texts = [texts[i] for i in batch]
+                max_tokens = self.batch_max_tokens(batch_texts, run)
+                lines.append(json.dumps({
+                    'custom_id': f"lot-{n}",
+                    'method': 'POST',
+                    'url': '/v1/chat/completions',
+                    'body': self.build_request_params(batch_texts, run,
+                                                      max_tokens)
+                }, ensure_ascii=False))
+
+            self.show_status("🌙 Envoi des lots à la Batch API...")
+            input_file = client.files.create(
+                file=("lots.jsonl", "\n".join(lines).encode('utf-8')),
+                purpose="batch")
+            job = client.batches.create(input_file_id=input_file.id,
+                                        endpoint="/v1/chat/completions",
+                                        completion_window="24h")
+            state = {'batch_id': job.id, 'batches': batches}
+            if state_path:
+                os.makedirs(os.path.dirname(state_path), exist_ok=True)
+                with open(state_path, 'w', encoding='utf-8') as f:
+                    json.dump(state, f)
+
+        batches = state['batches']
+        while True:
+            job = client.batches.retrieve(state['batch_id'])
+            if job.status in ('completed', 'failed', 'expired', 'cancelled'):
+                break
+            counts = job.request_counts
+            progress = (f" ({counts.completed}/{counts.total} lots)"
+                        if counts and counts.total else "")
+            self.show_status(f"🌙 Job {job.status}{progress}...")
+            time.sleep(self.batch_poll_interval)
+
+        if job.status != 'completed' and not job.output_file_id:
+            if state_path:
+                os.remove(state_path)
+            raise RuntimeError(f"Job Batch API terminé avec l'état {job.status}")
+
+        results = {}
+        if job.output_file_id:
+            output = client.files.content(job.output_file_id).text
+            for line in output.splitlines():
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                response = entry.get('response') or {}
+                if response.get('status_code') != 200:
+                    continue
+                body = response['body']
+                usage = (openai.types.CompletionUsage(**body['usage'])
+                         if body.get('usage') else None)
+                self.record_usage(usage)
+                n = int(entry['custom_id'].split('-', 1)[1])
+                batch_texts = [texts[i] for i in batches[n]]
+                self.observe_ratio(batch_texts, run, usage,
+                                   body['choices'][0].get('finish_reason')
+                                   == 'length')
+                content = body['choices'][0]['message']['content'] or ''
+                results[n] = self.parse_result(content.strip(), batch_texts,
+                                               run)
+
+        # Lignes manquantes ou lots en erreur : réparation en direct
+        target_count = len(run['targets'])
+        merged = {}
+        for n, batch in enumerate(batches):
+            received = results.get(n, {})
+            missing = sorted({p // target_count
+                              for p in range(len(batch) * target_count)
+                              if p not in received})
+            if missing:
+                self.show_status(f"🔧 Réparation de {len(missing)} lignes "
+                                 f"du lot {n + 1}...")
+                part = self.translate_lines(pool,
+                                            [texts[batch[j]] for j in missing],
+                                            run)
+                for p, text in part.items():
+                    j, k = divmod(p, target_count)
+                    received.setdefault(missing[j] * target_count + k, text)
+            merged[n] = (batch, received)
+
+        if state_path:
+            os.remove(state_path)
+        return merged
+
+    def show_status(self, text: str):
+        """Afficher un message d'état depuis un thread de travail"""
+        self.root.after(0, lambda: self.progress_label.config(text=text))
+
+    def translate_batch(self, texts: List[str],
+                        journal: TranslationJournal = None,
+                        done: Dict[tuple, str] = None,
+                        languages: List[str] = None) -> List[str]:
+        """Traduire un lot de textes via ChatGPT (lots envoyés en parallèle)
+
+        Chaque requête traduit ses lignes dans toutes les langues cibles à
+        la fois ; les résultats par langue sont rangés dans translated_sets
+        et la liste retournée est celle de la langue principale.
+        Les paires (langue, index) présentes dans done (reprise d'un
+        journal) ne sont pas renvoyées à l'API ; chaque lot terminé est
+        ajouté au journal. Une ligne dont la langue détectée (languages)
+        est la langue cible, ou dont l'écriture n'est pas celle de la
+        source, est recopiée telle quelle pour cette langue.
+        """
+        pool = self.build_endpoint_pool()
+        batch_size = self.batch_size_var.get()
+        max_workers = max(1, self.concurrency_var.get())
+
+        # Les variables Tk ne sont lues qu'ici, jamais depuis les workers
+        json_mode = self.json_mode_var.get()
+        targets = self.get_targets()
+        prompt = self.build_prompt(json_mode, targets)
+        self.usage_stats = {'prompt': 0, 'completion': 0, 'cached': 0}
+        model = self.model_choice.get()
+        if not pool.serving(model):
+            raise ValueError(f"Aucun endpoint ne sert le modèle {model} "
+                             "(section [ENDPOINTS])")
+        cascade_model = self.get_cascade_model()
+        if cascade_model and not pool.serving(cascade_model):
+            print(f"Cascade désactivée : aucun endpoint ne sert {cascade_model}")
+            cascade_model = ""
+        run = {
+            'source': self.source_lang.get(),
+            'prompt': prompt,
+            'model': model,
+            'targets': targets,
+            'token_packing': self.token_packing_var.get(),
+            'stream': self.stream_var.get(),
+            'json_mode': json_mode,
+            'batch_job': self.batch_job_var.get(),
+            'cascade_model': cascade_model,
+            'hedger': None
+        }
+        self.cascade_stats = {'lines': 0, 'escalated': 0}
+        target_count = len(targets)
+
+
+        finals = {target: texts.copy() for target in targets}
+        pending = [i for i, text in enumerate(texts)
+                   if text.strip() and len(text.strip()) > 2]
+
+
+        # Dédoublonnage : un seul envoi par texte distinct, recopié ensuite
+        occurrences = {}
+        for i in pending:
+            occurrences.setdefault(texts[i], []).append(i)
+        self.duplicate_count = len(pending) - len(occurrences)
+        pending = [indices[0] for indices in occurrences.values()]
+
+        # Paires (index, langue) déjà connues grâce au journal ou au cache
+        resolved = set()
+
+        def resolve(i, k, translation):
+            finals[targets[k]][i] = translation
+            resolved.add((i, k))
+            if k == 0:
+                self.commit_occurrences(occurrences, texts[i], translation)
+
+        if done:
+            for i in pending:
+                for k, target in enumerate(targets):
+                    if (target, i) in done:
+                        resolve(i, k, done[(target, i)])
+
+        self.language_kept = 0
+        if languages:
+            for i in pending:
+                for k, target in enumerate(targets):
+                    if ((i, k) not in resolved and LanguageIdentifier.keep_as_is(
+                            languages[i], run['source'], target)):
+                        resolve(i, k, texts[i])
+                        self.language_kept += len(occurrences[texts[i]])
+
+        memory = None
+        keys = {}
+        if self.use_cache_var.get():
+            memory = TranslationMemory(self.cache_file,
+                                       self.cache_max_entries,
+                                       self.cache_max_age_days)
+            source_lang = self.source_lang.get()
+            # Les résultats d'une cascade ne se mélangent pas à ceux d'un modèle seul
+            cache_model = (f"{run['cascade_model']}>{model}"
+                           if run['cascade_model'] else model)
+            for k, target in enumerate(targets):
+                # Clé indépendante du format de réponse et des autres langues
+                cache_prompt = self.build_prompt(False, [target])
+                for i in pending:
+                    if (i, k) not in resolved:
+                        keys[(i, k)] = memory.make_key(source_lang, target,
+                                                       cache_model, cache_prompt,
+                                                       texts[i])
+            cached = memory.lookup(set(keys.values()))
+
+            # Seuls les échecs de cache partent vers l'API
+            for (i, k), key in keys.items():
+                if key in cached:
+                    resolve(i, k, cached[key])
+
+        pending = [i for i in pending
+                   if any((i, k) not in resolved for k in range(target_count))]
+
+
+        if run['token_packing']:
+            batches = self.pack_batches(
+                pending, texts,
+                self.token_ratios.ratio(self.ratio_key(run),
+                                        self.max_tokens_percentile))
+        else:
+            batches = [pending[i:i + batch_size]
+                       for i in range(0, len(pending), batch_size)]
+        failed_indices = set()
+        fresh = set()
+
+        def merge(batch, received, only=None):
+            """Ranger les traductions d'un lot terminé (résultats, journal, cache)
+
+            only limite le rangement aux paires (index, langue) relancées après
+            validation ; une relance encore rejetée garde la traduction d'avant.
+            """
+            translated = []
+            for j, i in enumerate(batch):
+                for k, target in enumerate(targets):
+                    if (i, k) in resolved or (only is not None and
+                                              (i, k) not in only):
+                        continue
+                    p = j * target_count + k
+                    if p in received:
+                        if only is not None and self.check_translation(
+                                texts[i], received[p], target):
+                            continue
+                        finals[target][i] = received[p]
+                        translated.append((i, k, received[p]))
+                        fresh.add((i, k))
+                    elif only is None:
+                        failed_indices.add(i)
+
+            if journal:
+                journal.append([(i, targets[k], translation)
+                                for i, k, translation in translated])
+
+            if memory:
+                # Une traduction rejetée n'est pas mémorisée
+                memory.store([(keys[(i, k)], translation)
+                              for i, k, translation in translated
+                              if translation != texts[i] and not
+                              self.check_translation(texts[i], translation,
+                                                     targets[k])])
+
+        if run['batch_job'] and batches:
+            state_path = journal.path + '.batch.json' if journal else None
+            results = self.run_batch_job(pool, texts, batches,
+                                         run, state_path)
+            for batch, received in results.values():
+                for j, i in enumerate(batch):
+                    if (i, 0) not in resolved and j * target_count in received:
+                        self.commit_occurrences(occurrences, texts[i],
+                                                received[j * target_count])
+                merge(batch, received)
+            batches = []
+
+        if self.hedge_var.get() and batches:
+            # Plafond des doublons : fraction des tokens estimés du fichier
+            estimate = sum(self.estimate_request_tokens([texts[i] for i in batch],
+                                                        run)
+                           for batch in batches)
+            run['hedger'] = RequestHedger(self.hedge_percentile,
+                                          int(estimate * self.hedge_max_ratio),
+                                          self.hedge_model, max_workers)
+
+        def dispatch(batches, translate, only=None):
+            """Envoyer des lots en parallèle et ranger chaque lot terminé"""
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {}
+                for n, batch in enumerate(batches):
+                    batch_texts = [texts[i] for i in batch]
+
+                    # L'aperçu n'affiche que la langue principale
+                    def on_line(p, text, batch=batch):
+                        j, k = divmod(p, target_count)
+                        if k == 0 and (batch[j], 0) not in resolved:
+                            self.commit_occurrences(occurrences,
+                                                    texts[batch[j]], text)
+
+                    future = executor.submit(translate, pool, batch_texts, run,
+                                             on_line if only is None else None)
+                    futures[future] = (n, batch)
+
+                # Chaque lot connaît ses index : l'ordre de fin n'a pas d'effet
+                for future in as_completed(futures):
+                    n, batch = futures[future]
+                    try:
+                        received = future.result()
+                    except Exception as e:
+                        if only is None:
+                            failed_indices.update(batch)
+                        print(f"Erreur de traduction pour le lot {n + 1}: {e}")
+                        continue
+
+                    merge(batch, received, only)
+
+        dispatch(batches, self.cascade_lines if run['cascade_model']
+                 else self.translate_lines)
+
+        # Validation de tout le fichier : seules les lignes rejetées repartent
+        suspects = {}
+        flagged_count = 0
+        if self.validate_var.get():
+            for round_number in range(self.validation_rounds + 1):
+                suspects = self.validator.validate(
+                    [((i, k), texts[i], finals[targets[k]][i], targets[k])
+                     for i, k in sorted(fresh)])
+                if round_number == 0:
+                    flagged_count = len(suspects)
+                if not suspects or round_number == self.validation_rounds:
+                    break
+
+                for (i, k), reason in sorted(suspects.items()):
+                    print(f"Ligne {i + 1} ({targets[k]}) rejetée: {reason}")
+                self.show_status(f"🔍 Relance de {len(suspects)} traductions "
+                                 f"rejetées...")
+                lines = sorted({i for i, _ in suspects})
+                dispatch([lines[n:n + batch_size]
+                          for n in range(0, len(lines), batch_size)],
+                         self.translate_lines, set(suspects))
+
+        suspect_indices = {i for i, _ in suspects}
+        self.validation_stats = (flagged_count, len(suspect_indices))
+
+        for indices in occurrences.values():
+            for translations in finals.values():
+                for i in indices[1:]:
+                    translations[i] = translations[indices[0]]
+            if indices[0] in failed_indices:
+                failed_indices.update(indices[1:])
+            if indices[0] in suspect_indices:
+                suspect_indices.update(indices[1:])
+
+        self.failed_indices = sorted(failed_indices)
+        self.suspect_indices = sorted(suspect_indices - failed_indices)
+        try:
+            self.token_ratios.save()
+        except OSError as e:
+            print(f"Rapports de tokens non sauvegardés: {e}")
+        self.translated_sets = finals
+        self.endpoint_summary = pool.summary() if len(pool.endpoints) > 1 else ""
+        hedger = run['hedger']
+        if hedger:
+            hedger.close()
+            self.hedge_stats = (hedger.hedges, hedger.wins, hedger.extra_tokens)
+        else:
+            self.hedge_stats = (0, 0, 0)
+
+        if memory:
+            memory.evict()
+            self.cache_stats = (memory.hits, memory.misses)
+            memory.close()
+
+        return finals[targets[0]]
+
+    def commit_occurrences(self, occurrences: Dict[str, List[int]],
+                           source: str, translation: str):
+        """Valider une traduction pour toutes les occurrences d'un texte"""
+        for i in occurrences[source]:
+            self.commit_line(i, translation)
+
+    def commit_line(self, index: int, translation: str):
+        """Afficher une ligne traduite dans l'aperçu dès sa réception
+
+        Appelé depuis les workers : la mise à jour est confiée à la boucle Tk.
+        """
+        self.root.after(0, self.show_committed_line, index, translation)
+
+    def show_committed_line(self, index: int, translation: str):
+        """Remplacer la ligne index de l'aperçu par sa traduction"""
+        text = self.clean_ass_text(translation)
+        if len(text) > 120:
+            text = text[:120] + '...'
+        line = f"{index + 1}"
+        self.translated_text.delete(f"{line}.0", f"{line}.end")
+        self.translated_text.insert(f"{line}.0", f"[{index+1:03d}] {text}")
+        self.progress['value'] += 1
+        self.progress_label.config(
+            text=f"Traduit {int(self.progress['value'])}/"
+                 f"{len(self.subtitle_lines)} lignes")
 
     def start_translation(self):
         """Démarrer la traduction en arrière-plan"""
@@ -771,7 +3672,7 @@ Réponds seulement les traductions numérotées."""
                                    "Veuillez d'abord analyser un fichier")
             return
 
-        if not self.api_key.get():
+        if not self.api_key.get() and not self.endpoints:
             messagebox.showwarning("Attention",
                                    "Veuillez configurer votre clé API OpenAI")
             return
@@ -781,19 +3682,72 @@ Réponds seulement les traductions numérotées."""
         thread.daemon = True
         thread.start()
 
+    def open_journal(self):
+        """Ouvrir le journal du fichier courant et proposer une reprise"""
+        settings = {
+            'source': self.source_lang.get(),
+            'targets': self.get_targets(),
+            'model': self.model_choice.get(),
+            'prompt': self.build_prompt()
+        }
+        if self.get_cascade_model():
+            settings['cascade_model'] = self.get_cascade_model()
+        key = TranslationJournal.make_key(self.selected_file, settings)
+        journal = TranslationJournal(
+            os.path.join(self.journal_dir, f"{key}.jsonl"))
+
+        done = journal.load()
+        if done:
+            resume = messagebox.askyesno(
+                "Reprise",
+                f"Une traduction interrompue de ce fichier a été trouvée "
+                f"({len(done)} lignes déjà traduites).\n\n"
+                f"Reprendre là où elle s'est arrêtée ?")
+            if not resume:
+                journal.remove()
+                done = {}
+
+        return journal, done
+
     def translate_file(self):
         """Traduire le fichier complet"""
         try:
+            # Les champs sont relus dans le fichier : il doit être celui analysé
+            try:
+                self.subtitle_lines.check_source()
+            except (ValueError, OSError) as e:
+                messagebox.showwarning("Attention",
+                                       f"Traduction impossible: {e}")
+                self.progress_label.config(text="Nouvelle analyse nécessaire")
+                return
 
             self.progress.config(maximum=len(self.subtitle_lines))
             self.progress_label.config(text="Traduction en cours...")
 
 
-            texts_to_translate = [line['text'] for line in self.subtitle_lines]
+            texts_to_translate = self.texts_to_translate()
+            self.tag_languages()
+
+            # Aperçu pré-rempli : chaque ligne est remplacée dès sa traduction
+            self.progress['value'] = 0
+            events = self.subtitle_lines
+            placeholder = "\n".join(
+                f"[{i+1:03d}] …" if action == 'translate'
+                else f"[{i+1:03d}] {text[:120]}"
+                for i, (text, action) in enumerate(zip(events.texts,
+                                                       events.actions)))
+            self.translated_text.delete(1.0, tk.END)
+            self.translated_text.insert(1.0, placeholder)
 
+            journal, done = self.open_journal()
 
             self.progress_label.config(text="Traduction en cours...")
-            all_translations = self.translate_batch(texts_to_translate)
+            all_translations = self.translate_batch(texts_to_translate,
+                                                    journal, done,
+                                                    self.line_languages())
+
+            if not self.failed_indices:
+                journal.remove()
 
 
             total = len(texts_to_translate)
@@ -805,7 +3759,9 @@ Réponds seulement les traductions numérotées."""
 
             preview_lines = []
             for i, translation in enumerate(all_translations):
-                text = translation
+                # Les événements copiés ou ignorés restent tels quels
+                text = (self.clean_ass_text(translation) or
+                        self.subtitle_lines.texts[i])
                 if len(text) > 120:
                     text = text[:120] + '...'
                 preview_lines.append(f"[{i+1:03d}] {text}")
@@ -816,10 +3772,78 @@ Réponds seulement les traductions numérotées."""
             preview_text += (f"\n\n✅ Traduction terminée: "
                              f"{len(all_translations)} lignes traduites")
 
+            if len(self.translated_sets) > 1:
+                preview_text += ("\n🌐 Langues: " +
+                                 ", ".join(self.translated_sets) +
+                                 " (aperçu de la langue principale)")
+
+            preview_text += "\n" + self.describe_triage()
+
+            if self.language_kept:
+                preview_text += (f"\n🔤 {self.language_kept} traductions "
+                                 f"évitées : lignes déjà dans la langue "
+                                 f"cible ou dans une autre écriture")
+
+            if self.duplicate_count:
+                preview_text += (f"\n🔁 {self.duplicate_count} doublons "
+                                 f"traduits une seule fois")
+
+            usage = self.usage_stats
+            if usage['prompt']:
+                preview_text += (f"\n🧮 Tokens: {usage['prompt']} en entrée "
+                                 f"(dont {usage['cached']} servis par le cache "
+                                 f"de prompt), {usage['completion']} en sortie")
+
+            flagged, remaining = self.validation_stats
+            if flagged:
+                preview_text += (f"\n🔍 Validation: {flagged} traductions "
+                                 f"rejetées et relancées, {remaining} lignes "
+                                 f"encore suspectes")
+                if self.suspect_indices:
+                    suspects = ", ".join(str(i + 1)
+                                         for i in self.suspect_indices[:20])
+                    if len(self.suspect_indices) > 20:
+                        suspects += ", ..."
+                    preview_text += f" (lignes {suspects})"
+
+            cascade = self.cascade_stats
+            if cascade['lines']:
+                preview_text += (f"\n🪜 Cascade: {cascade['escalated']}/"
+                                 f"{cascade['lines']} lignes escaladées vers "
+                                 f"{self.model_choice.get()}")
+
+            hedges, wins, extra_tokens = self.hedge_stats
+            if hedges:
+                preview_text += (f"\n🏁 {hedges} lots doublés ({wins} gagnés par "
+                                 f"le doublon, ~{extra_tokens} tokens en plus)")
+
+            if self.endpoint_summary:
+                preview_text += f"\n🔀 Requêtes par endpoint: {self.endpoint_summary}"
+
+            if self.use_cache_var.get():
+                hits, misses = self.cache_stats
+                preview_text += (f"\n💾 Mémoire de traduction: {hits} lignes "
+                                 f"réutilisées, {misses} envoyées à l'API")
+
             self.translated_text.delete(1.0, tk.END)
             self.translated_text.insert(1.0, preview_text)
 
             self.progress['value'] = len(texts_to_translate)
+
+            if self.failed_indices:
+                failed = ", ".join(str(i + 1) for i in self.failed_indices[:20])
+                if len(self.failed_indices) > 20:
+                    failed += ", ..."
+                self.progress_label.config(
+                    text=f"Traduction terminée avec "
+                         f"{len(self.failed_indices)} lignes non traduites")
+                messagebox.showwarning(
+                    "Attention",
+                    f"{len(self.failed_indices)} lignes n'ont pas pu être "
+                    f"traduites et sont restées en langue source "
+                    f"(lignes {failed})")
+                return
+
             self.progress_label.config(text="Traduction terminée !")
 
             messagebox.showinfo("Terminé", "Traduction terminée avec succès !")
@@ -830,12 +3854,16 @@ Réponds seulement les traductions numérotées."""
             self.progress_label.config(text="Erreur de traduction")
 
     def save_translation(self):
-        """Sauvegarder le fichier traduit"""
+        """Sauvegarder le fichier traduit (un fichier par langue cible)"""
         if not self.translated_lines:
             messagebox.showwarning("Attention",
                                    "Aucune traduction à sauvegarder")
             return
 
+        if len(self.translated_sets) > 1:
+            self.save_all_translations()
+            return
+
 
         filetypes = [("Fichiers ASS", "*.ass"), ("Tous les fichiers", "*.*")]
         initial_name = (self.output_file.name if self.output_file
@@ -852,41 +3880,93 @@ Réponds seulement les traductions numérotées."""
             return
 
         try:
+            self.write_translation(output_file, self.translated_lines)
 
-            with open(self.selected_file, 'r', encoding='utf-8-sig') as f:
-                original_content = f.read()
-
-
-            lines = original_content.split('\n')
-            translation_index = 0
-
-            for i, line in enumerate(lines):
-                if (line.strip().startswith('Dialogue:') and
-                        translation_index < len(self.translated_lines)):
-
-                    dialogue_data = self.subtitle_lines[translation_index]
-                    new_dialogue = dialogue_data['dialogue_dict'].copy()
-                    new_dialogue['Text'] = self.translated_lines[
-                        translation_index]
+            messagebox.showinfo("Succès", f"Fichier sauvegardé: {output_file}")
 
+        except Exception as e:
+            messagebox.showerror("Erreur",
+                                 f"Erreur lors de la sauvegarde: {e}")
 
-                    dialogue_parts = [
-                        new_dialogue.get(field, '') for field in
-                        dialogue_data['dialogue_dict'].keys()
-                    ]
-                    lines[i] = f"Dialogue: {','.join(dialogue_parts)}"
-                    translation_index += 1
+    def save_all_translations(self):
+        """Sauvegarder un fichier .ass par langue dans un même dossier"""
+        source = Path(self.selected_file)
+        folder = filedialog.askdirectory(
+            title="Dossier de sauvegarde des traductions",
+            initialdir=str(source.parent))
 
+        if not folder:
+            return
 
-            with open(output_file, 'w', encoding='utf-8-sig') as f:
-                f.write('\n'.join(lines))
+        try:
+            saved = []
+            for language, translations in self.translated_sets.items():
+                name = f"{source.stem}_{language.lower()}{source.suffix}"
+                output_file = os.path.join(folder, name)
+                self.write_translation(output_file, translations)
+                saved.append(name)
 
-            messagebox.showinfo("Succès", f"Fichier sauvegardé: {output_file}")
+            messagebox.showinfo("Succès", "Fichiers sauvegardés:\n" +
+                                "\n".join(saved))
 
         except Exception as e:
             messagebox.showerror("Erreur",
                                  f"Erreur lors de la sauvegarde: {e}")
 
+    def write_translation(self, output_file: str, translations: List[str]):
+        """Écrire une copie du fichier source avec les dialogues traduits
+
+        Une seule passe en flux sur le fichier d'origine : les zones
+        inchangées sont recopiées par blocs entre les positions relevées à
+        l'analyse (transcodées en UTF-8 au-delà du passage en latin-1),
+        seules les lignes Dialogue: traduites sont réencodées. Le fichier
+        écrit est en UTF-8 avec BOM ; il est d'abord écrit à côté puis mis
+        en place, ce qui permet d'écraser le fichier source.
+        """
+        events = self.subtitle_lines
+        events.check_source()
+        replacements = []
+        for index, translation in enumerate(translations[:len(events)]):
+            if (events.actions[index] != 'translate' or
+                    translation == events.sent_text(index)):
+                # Copié, ignoré ou gardé dans sa langue : ligne d'origine conservée
+                continue
+
+            runs = events.tag_runs(index)
+            if runs:
+                translation = TagMask.unmask(translation, runs)
+            replacements.append((events.starts[index], events.ends[index],
+                                 events.with_text(index, translation)))
+        events.close()
+
+        fallback = events.fallback_start
+        chunk_size = 1 << 20
+
+        def copy(start, end):
+            source.seek(start)
+            while start < end:
+                stop = min(end, start + chunk_size)
+                if fallback is not None and start < fallback < stop:
+                    stop = fallback
+                data = source.read(stop - start)
+                if fallback is not None and start >= fallback:
+                    data = data.decode('latin-1').encode('utf-8')
+                output.write(data)
+                start = stop
+
+        temporary_file = output_file + ".tmp"
+        with open(events.path, 'rb') as source, \
+                open(temporary_file, 'wb') as output:
+            if not events.bom:
+                output.write(codecs.BOM_UTF8)
+            position = 0
+            for start, end, line in replacements:
+                copy(position, start)
+                output.write(line.encode('utf-8'))
+                position = end
+            copy(position, events.size)
+        os.replace(temporary_file, output_file)
+
     def run(self):
         """Lancer l'application"""
         self.setup_ui()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Serveur local imitant l'API OpenAI (fichiers, Batch API, chat)
+Permet de tester hors ligne le mode job différé du traducteur ASS
+"""
+
+import argparse
+import email
+import email.policy
+import json
+import os
+import re
+import threading
+import time
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class LocalBatchBackend:
+    """Stockage en mémoire des fichiers et des jobs, et exécution des requêtes"""
+
+    def __init__(self, upstream=None, upstream_key=None, delay=0.0):
+        self.upstream = upstream.rstrip('/') if upstream else None
+        self.upstream_key = upstream_key
+        self.delay = delay
+        self.files = {}
+        self.batches = {}
+        self.lock = threading.Lock()
+
+    def add_file(self, filename, purpose, content):
+        """Enregistrer un fichier et retourner son objet"""
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        file_object = {
+            'id': file_id,
+            'object': 'file',
+            'bytes': len(content),
+            'created_at': int(time.time()),
+            'filename': filename,
+            'purpose': purpose,
+            'status': 'processed'
+        }
+        with self.lock:
+            self.files[file_id] = (file_object, content)
+        return file_object
+
+    def create_batch(self, input_file_id, endpoint, completion_window):
+        """Créer un job et lancer son traitement en arrière-plan"""
+        if input_file_id not in self.files:
+            return None
+
+        batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+        batch = {
+            'id': batch_id,
+            'object': 'batch',
+            'endpoint': endpoint,
+            'errors': None,
+            'input_file_id': input_file_id,
+            'completion_window': completion_window,
+            'status': 'validating',
+            'output_file_id': None,
+            'error_file_id': None,
+            'created_at': int(time.time()),
+            'in_progress_at': None,
+            'completed_at': None,
+            'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+            'metadata': None
+        }
+        with self.lock:
+            self.batches[batch_id] = batch
+
+        thread = threading.Thread(target=self.process_batch, args=(batch_id,))
+        thread.daemon = True
+        thread.start()
+        return batch
+
+    def process_batch(self, batch_id):
+        """Exécuter chaque ligne du fichier d'entrée et produire le fichier de sortie"""
+        batch = self.batches[batch_id]
+        _, content = self.files[batch['input_file_id']]
+        requests = [json.loads(line) for line in content.decode('utf-8').splitlines()
+                    if line.strip()]
+
+        batch['status'] = 'in_progress'
+        batch['in_progress_at'] = int(time.time())
+        batch['request_counts']['total'] = len(requests)
+
+        outputs = []
+        errors = []
+        for request in requests:
+            time.sleep(self.delay)
+            if batch['status'] == 'cancelling':
+                break
+            try:
+                body = self.chat_completion(request['body'])
+                outputs.append({
+                    'id': f"batch_req_{uuid.uuid4().hex[:24]}",
+                    'custom_id': request['custom_id'],
+                    'response': {'status_code': 200,
+                                 'request_id': uuid.uuid4().hex,
+                                 'body': body},
+                    'error': None
+                })
+                batch['request_counts']['completed'] += 1
+            except Exception as e:
+                errors.append({
+                    'id': f"batch_req_{uuid.uuid4().hex[:24]}",
+                    'custom_id': request.get('custom_id'),
+                    'response': None,
+                    'error': {'code': 'server_error', 'message': str(e)}
+                })
+                batch['request_counts']['failed'] += 1
+
+        batch['status'] = 'finalizing'
+        if outputs:
+            output = "\n".join(json.dumps(line, ensure_ascii=False)
+                               for line in outputs).encode('utf-8')
+            batch['output_file_id'] = self.add_file(
+                "batch_output.jsonl", 'batch_output', output)['id']
+        if errors:
+            output = "\n".join(json.dumps(line, ensure_ascii=False)
+                               for line in errors).encode('utf-8')
+            batch['error_file_id'] = self.add_file(
+                "batch_errors.jsonl", 'batch_output', output)['id']
+
+        cancelled = batch['status'] == 'cancelling'
+        batch['status'] = 'cancelled' if cancelled else 'completed'
+        batch['completed_at'] = int(time.time())
+
+    def chat_completion(self, body):
+        """Répondre à une requête chat : relais vers upstream ou écho"""
+        if self.upstream:
+            request = urllib.request.Request(
+                f"{self.upstream}/chat/completions",
+                data=json.dumps(dict(body, stream=False)).encode('utf-8'),
+                headers={'Content-Type': 'application/json',
+                         'Authorization': f"Bearer {self.upstream_key or ''}"})
+            with urllib.request.urlopen(request, timeout=600) as response:
+                return json.loads(response.read())
+
+        content = self.echo_reply(body['messages'][0]['content'],
+                                  body['messages'][-1]['content'])
+        prompt_tokens = sum(len(m.get('content') or '') for m in body['messages']) // 4
+        completion_tokens = len(content) // 4
+        return {
+            'id': f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'local-echo'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': prompt_tokens,
+                      'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens}
+        }
+
+    def echo_reply(self, system_prompt, user_content):
+        """Renvoyer les lignes reçues dans le format de réponse attendu
+
+        Aucune traduction n'est faite : le but est de vérifier l'aller-retour
+        (numérotation, JSON, fichiers, suivi du job) sans appel payant.
+        """
+        # Plusieurs langues cibles annoncées sous la forme « 1=French, 2=Spanish »
+        target_count = len(re.findall(r'\b\d+=\w', system_prompt or ''))
+
+        def ids(line_id):
+            if target_count > 1:
+                return [f"{line_id}.{k + 1}" for k in range(target_count)]
+            return [line_id]
+
+        try:
+            data = json.loads(user_content)
+        except ValueError:
+            data = None
+
+        if isinstance(data, dict) and 'lines' in data:
+            return json.dumps({'translations': [
+                {'id': item_id, 'text': line['text']}
+                for line in data['lines'] for item_id in ids(line['id'])
+            ]}, ensure_ascii=False)
+
+        replies = []
+        for line in user_content.split('\n'):
+            match = re.match(r'^(\d+)\.\s*(.*)$', line)
+            if match:
+                replies.extend(f"{item_id}. {match.group(2)}"
+                               for item_id in ids(match.group(1)))
+        return "\n".join(replies)
+
+
+class LocalBatchHandler(BaseHTTPRequestHandler):
+    """Routes /v1/files, /v1/batches et /v1/chat/completions"""
+
+    backend = None
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        self.send_json({'error': {'message': message, 'type': 'invalid_request_error'}},
+                       status)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length)
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0].rstrip('/')
+
+        match = re.fullmatch(r'/v1/files/([\w-]+)/content', path)
+        if match:
+            entry = self.backend.files.get(match.group(1))
+            if not entry:
+                return self.send_error_json(404, "Fichier introuvable")
+            content = entry[1]
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+            return
+
+        match = re.fullmatch(r'/v1/files/([\w-]+)', path)
+        if match:
+            entry = self.backend.files.get(match.group(1))
+            if not entry:
+                return self.send_error_json(404, "Fichier introuvable")
+            return self.send_json(entry[0])
+
+        match = re.fullmatch(r'/v1/batches/([\w-]+)', path)
+        if match:
+            batch = self.backend.batches.get(match.group(1))
+            if not batch:
+                return self.send_error_json(404, "Job introuvable")
+            return self.send_json(batch)
+
+        if path == '/v1/batches':
+            return self.send_json({'object': 'list',
+                                   'data': list(self.backend.batches.values()),
+                                   'has_more': False})
+
+        self.send_error_json(404, f"Route inconnue: {path}")
+
+    def do_POST(self):
+        path = self.path.split('?', 1)[0].rstrip('/')
+        body = self.read_body()
+
+        if path == '/v1/files':
+            content_type = self.headers.get('Content-Type', '')
+            message = email.message_from_bytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode('utf-8') + body,
+                policy=email.policy.HTTP)
+
+            fields = {}
+            for part in message.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                fields[name] = (part.get_filename(), part.get_payload(decode=True))
+
+            if 'file' not in fields:
+                return self.send_error_json(400, "Champ 'file' manquant")
+            filename, content = fields['file']
+            purpose = fields.get('purpose', (None, b'batch'))[1].decode('utf-8')
+            return self.send_json(self.backend.add_file(filename or 'upload.jsonl',
+                                                        purpose, content))
+
+        match = re.fullmatch(r'/v1/batches/([\w-]+)/cancel', path)
+        if match:
+            batch = self.backend.batches.get(match.group(1))
+            if not batch:
+                return self.send_error_json(404, "Job introuvable")
+            if batch['status'] in ('validating', 'in_progress'):
+                batch['status'] = 'cancelling'
+            return self.send_json(batch)
+
+        if path == '/v1/batches':
+            request = json.loads(body or b'{}')
+            batch = self.backend.create_batch(request.get('input_file_id'),
+                                              request.get('endpoint'),
+                                              request.get('completion_window', '24h'))
+            if batch is None:
+                return self.send_error_json(400, "input_file_id inconnu")
+            return self.send_json(batch)
+
+        if path == '/v1/chat/completions':
+            request = json.loads(body or b'{}')
+            try:
+                completion = self.backend.chat_completion(request)
+            except Exception as e:
+                return self.send_error_json(502, f"Erreur upstream: {e}")
+
+            if not request.get('stream'):
+                return self.send_json(completion)
+
+            # Réponse en flux (SSE) : un fragment de contenu puis l'usage
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.end_headers()
+            chunk = {
+                'id': completion['id'],
+                'object': 'chat.completion.chunk',
+                'created': completion['created'],
+                'model': completion['model'],
+                'choices': [{'index': 0,
+                             'delta': {'role': 'assistant',
+                                       'content': completion['choices'][0]['message']['content']},
+                             'finish_reason': 'stop'}]
+            }
+            usage_chunk = dict(chunk, choices=[], usage=completion.get('usage'))
+            for event in (chunk, usage_chunk):
+                self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+                                 .encode('utf-8'))
+            self.wfile.write(b"data: [DONE]\n\n")
+            return
+
+        self.send_error_json(404, f"Route inconnue: {path}")
+
+    def log_message(self, format, *args):
+        print(f"[{self.log_date_time_string()}] {format % args}")
+
+
+def main():
+    """Point d'entrée principal"""
+    parser = argparse.ArgumentParser(
+        description="Serveur local compatible OpenAI (fichiers, Batch API, chat) "
+                    "pour tester le traducteur ASS hors ligne")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--upstream',
+                        help="URL d'un serveur chat compatible OpenAI vers "
+                             "lequel relayer les requêtes (sinon : écho)")
+    parser.add_argument('--upstream-key', default=os.environ.get('OPENAI_API_KEY'),
+                        help="Clé API de l'upstream (défaut : OPENAI_API_KEY)")
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help="Délai simulé par requête d'un job, en secondes")
+    args = parser.parse_args()
+
+    LocalBatchHandler.backend = LocalBatchBackend(args.upstream, args.upstream_key,
+                                                  args.delay)
+    server = ThreadingHTTPServer((args.host, args.port), LocalBatchHandler)
+
+    print(f"Serveur local prêt sur http://{args.host}:{args.port}/v1")
+    print("Dans translator_config.ini : [API] base_url = "
+          f"http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nServeur arrêté")
+
+
+if __name__ == "__main__":
+    main()
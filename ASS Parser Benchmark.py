@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Banc d'essai du lecteur de sous-titres ASS
+Compare en lignes par seconde l'ancien parseur (expressions régulières
+ligne par ligne) et AssLexer, sur un fichier synthétique ou un fichier réel
+"""
+
+import argparse
+import importlib.util
+import os
+import platform
+import random
+import re
+import time
+
+
+def load_translator():
+    """Charger le module du traducteur (son nom de fichier contient des espaces)"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "ASS Auto translator.py")
+    spec = importlib.util.spec_from_file_location("ass_auto_translator", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def legacy_clean(text):
+    """Nettoyage du texte tel que le faisait l'ancien parseur"""
+    text = re.sub(r'\{[^}]*\}', '', text)
+    text = text.replace('\\N', ' ')
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+
+def legacy_parse(content):
+    """Ancien parseur : strip, découpage du Format et nettoyage à chaque ligne"""
+    dialogues = []
+    in_events_section = False
+    format_line = None
+
+    for line in content.split('\n'):
+        line = line.strip()
+
+        if line == '[Events]':
+            in_events_section = True
+            continue
+
+        if line.startswith('[') and line != '[Events]':
+            in_events_section = False
+            continue
+
+        if in_events_section:
+            if line.startswith('Format:'):
+                format_line = line[7:].strip()
+                continue
+
+            if line.startswith('Dialogue:') and format_line:
+                dialogue_data = line[9:].strip()
+                fields = [f.strip() for f in format_line.split(',')]
+                values = dialogue_data.split(',', len(fields) - 1)
+
+                if len(values) >= len(fields):
+                    dialogue_dict = dict(zip(fields, values))
+                    if 'Text' in dialogue_dict:
+                        text = legacy_clean(dialogue_dict['Text'])
+                        if text.strip():
+                            dialogues.append((text, dialogue_dict))
+    return dialogues
+
+
+def lexer_parse(content, lexer_class):
+    """Nouveau parseur : une passe d'AssLexer, même résultat que legacy_parse"""
+    dialogues = []
+    for _, kind, fields, values, text, _ in lexer_class().events(
+            content.split('\n')):
+        if kind == 'Dialogue' and values is not None and text:
+            dialogues.append((text, dict(zip(fields, values))))
+    return dialogues
+
+
+def synthetic_script(count, seed=0):
+    """Script ASS de count événements : dialogues, italiques et karaoké"""
+    rng = random.Random(seed)
+    words = ("the", "night", "sky", "we", "run", "again", "tonight", "never",
+             "forget", "your", "name", "under", "stars", "light")
+    lines = [
+        "[Script Info]", "ScriptType: v4.00+", "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, Bold, Italic",
+        "Style: Default,Arial,20,&H00FFFFFF,0,0", "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, "
+        "Effect, Text",
+    ]
+    for n in range(count):
+        start = f"0:{n // 3600 % 60:02d}:{n // 60 % 60:02d}.{n % 100:02d}"
+        kind = n % 4
+        if kind == 3:
+            text = ''.join(f"{{\\k{rng.randint(10, 60)}}}{rng.choice(words)} "
+                           for _ in range(rng.randint(4, 10)))
+            style = "OP Romaji"
+        else:
+            sentence = ' '.join(rng.choice(words)
+                                for _ in range(rng.randint(3, 14)))
+            if kind == 1:
+                text = f"{{\\i1}}{sentence}{{\\i0}}"
+            elif kind == 2:
+                half = len(sentence) // 2
+                text = f"{{\\an8\\pos(320,50)}}{sentence[:half]}\\N{sentence[half:]}"
+            else:
+                text = sentence.capitalize() + "."
+            style = "Default"
+        lines.append(f"Dialogue: 0,{start},{start},{style},,0,0,0,,{text}")
+    return '\n'.join(lines) + '\n'
+
+
+def measure(parse, content, repeat):
+    """Meilleur temps sur repeat passes et résultat de la dernière"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = parse(content)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    """Point d'entrée principal"""
+    parser = argparse.ArgumentParser(
+        description="Compare l'ancien parseur ASS et AssLexer (lignes/s)")
+    parser.add_argument("file", nargs="?",
+                        help="fichier .ass à lire (sinon fichier synthétique)")
+    parser.add_argument("--events", type=int, default=100000,
+                        help="nombre d'événements du fichier synthétique")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="nombre de passes (le meilleur temps est gardé)")
+    args = parser.parse_args()
+
+    if args.file:
+        try:
+            with open(args.file, 'r', encoding='utf-8-sig') as f:
+                content = f.read()
+        except UnicodeDecodeError:
+            with open(args.file, 'r', encoding='latin-1') as f:
+                content = f.read()
+    else:
+        content = synthetic_script(args.events)
+    line_count = content.count('\n') + 1
+
+    lexer_class = load_translator().AssLexer
+    legacy_time, legacy_result = measure(legacy_parse, content, args.repeat)
+    lexer_time, lexer_result = measure(
+        lambda text: lexer_parse(text, lexer_class), content, args.repeat)
+
+    if legacy_result != lexer_result:
+        print("⚠️ Les deux parseurs ne donnent pas le même résultat")
+
+    print(f"📄 {line_count} lignes, {len(lexer_result)} dialogues, "
+          f"meilleur de {args.repeat} passes")
+    print(f"🖥️ Python {platform.python_version()} "
+          f"({platform.python_implementation()}), {platform.machine()}")
+    for name, elapsed in (("Ancien parseur", legacy_time),
+                          ("AssLexer", lexer_time)):
+        print(f"{name:>15}: {elapsed * 1000:8.1f} ms, "
+              f"{line_count / elapsed:12,.0f} lignes/s")
+    print(f"⚡ Gain: x{legacy_time / lexer_time:.2f}")
+
+
+if __name__ == "__main__":
+    main()